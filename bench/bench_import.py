@@ -0,0 +1,58 @@
+"""times the bulk user import against a copy of the bundled database.
+
+Run from the repository root:
+
+    python bench/bench_import.py --rows 10000 100000
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_csv(rows, prefix):
+    """builds an upload file with the given number of new students"""
+    lines = ["User ID,First Name,Last Name,Form Class,Role"]
+    lines.extend(
+        f"{prefix}{i},First{i},Last{i},13{'ABCDEFGH'[i % 8]}XX,student" for i in range(rows))
+    return io.BytesIO(("\n".join(lines) + "\n").encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "data.db")
+        shutil.copy(os.path.join(ROOT, "myserve", "data.db"), path)
+        os.environ["DATABASE_URL"] = "sqlite:///" + path
+
+        from myserve import app
+        from myserve.imports import import_users
+
+        with app.app_context():
+            for run, rows in enumerate(args.rows):
+                upload = make_csv(rows, prefix=f"B{run}-")
+
+                tracemalloc.start()
+                start = time.perf_counter()
+                num_users, errors = import_users(upload)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                print(f"{rows:>8} rows  {elapsed:8.2f} s  {num_users / elapsed:10.0f} rows/s  "
+                      f"peak {peak / 1024 / 1024:6.1f} MiB  errors {len(errors)}")
+
+
+if __name__ == "__main__":
+    main()
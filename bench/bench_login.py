@@ -0,0 +1,53 @@
+"""times the /login/callback chain against the mock OAuth server.
+
+Run from the repository root:
+
+    python bench/bench_login.py --runs 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_oauth import MockOAuthServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--delay", type=float, default=0,
+                        help="artificial latency added to each mock response")
+    args = parser.parse_args()
+
+    with MockOAuthServer(delay=args.delay) as server:
+        # all of these have to be set before the app reads them on import
+        os.environ["GOOGLE_DISCOVERY_URL"] = server.discovery_url
+        os.environ.setdefault("GOOGLE_CLIENT_ID", "bench")
+        os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench")
+        os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+
+        from myserve import app
+        from myserve.auth import google_discovery
+
+        timings = []
+        with app.test_client() as client:
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                client.get("/login/callback?code=mock-code")
+                timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        print(f"runs:           {args.runs}")
+        print(f"mock requests:  {server.requests}")
+        print(f"p50:            {statistics.median(timings):.2f} ms")
+        print(f"p95:            {timings[int(len(timings) * 0.95) - 1]:.2f} ms")
+        print(f"max:            {timings[-1]:.2f} ms")
+        print(f"discovery:      {google_discovery.stats()}")
+
+
+if __name__ == "__main__":
+    main()
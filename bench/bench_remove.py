@@ -0,0 +1,62 @@
+"""times removing a cohort of students with User.remove_users() on a copy of the bundled database.
+
+Run from the repository root:
+
+    python bench/bench_remove.py --students 500 --hours 200
+"""
+import argparse
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--hours", type=int, default=200,
+                        help="log entries per student")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "data.db")
+        shutil.copy(os.path.join(ROOT, "myserve", "data.db"), path)
+        os.environ["DATABASE_URL"] = "sqlite:///" + path
+
+        from myserve import app, db
+        from myserve.models import USER_ROLE, User, Log, Group, GroupMembers
+
+        with app.app_context():
+            group = Group.create("Benchmark Group")
+            user_ids = [f"R{i}" for i in range(args.students)]
+            db.session.bulk_insert_mappings(User, [
+                {"id": user_id, "first_name": "Bench", "last_name": user_id,
+                 "email": f"{user_id.lower()}@bench", "form_class": "13BEN",
+                 "role_id": USER_ROLE["student"], "total": args.hours}
+                for user_id in user_ids])
+            db.session.bulk_insert_mappings(GroupMembers, [
+                {"user_id": user_id, "group_id": group.id, "group_hours": args.hours}
+                for user_id in user_ids])
+            today = datetime.date.today()
+            db.session.bulk_insert_mappings(Log, [
+                {"user_id": user_id, "group_id": group.id, "time": 1, "status_id": 1,
+                 "date": today, "log_time": datetime.datetime.now(), "description": "bench"}
+                for user_id in user_ids for _ in range(args.hours)])
+            db.session.commit()
+
+            start = time.perf_counter()
+            removed = User.remove_users(user_ids)
+            elapsed = time.perf_counter() - start
+
+            print(f"removed {removed} students with {removed * args.hours} log entries "
+                  f"in {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""measures how many hour-logging transactions per second SQLite manages with several writers at once,
+first with SQLite's default settings and then with the settings from myserve/database.py.
+
+Run from the repository root:
+
+    python bench/bench_writers.py --threads 8 --writes 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, text
+from myserve.database import set_sqlite_pragmas, SQLITE_BUSY_TIMEOUT
+
+SCHEMA = [
+    'CREATE TABLE "user" (user_id STRING PRIMARY KEY, total DECIMAL)',
+    'CREATE TABLE log (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id STRING, time DECIMAL, '
+    'description STRING, log_time DATETIME)',
+]
+
+
+def run(path, tuned, threads, writes):
+    """runs the benchmark against a fresh database, returning (transactions per second, failures)"""
+    engine = create_engine(
+        "sqlite:///" + path,
+        connect_args={"timeout": SQLITE_BUSY_TIMEOUT / 1000})
+    if tuned:
+        event.listen(engine, "connect", set_sqlite_pragmas)
+
+    with engine.begin() as connection:
+        for statement in SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(
+            text('INSERT INTO "user" (user_id, total) VALUES (:id, 0)'),
+            [{"id": str(i)} for i in range(threads)])
+
+    failures = []
+
+    def writer(user_id):
+        for _ in range(writes):
+            try:
+                with engine.begin() as connection:
+                    connection.execute(
+                        text("INSERT INTO log (user_id, time, description, log_time) "
+                             "VALUES (:id, 1, 'bench', CURRENT_TIMESTAMP)"),
+                        {"id": user_id})
+                    connection.execute(
+                        text('UPDATE "user" SET total = total + 1 WHERE user_id = :id'),
+                        {"id": user_id})
+                    # a reader on the same page as the writers
+                    connection.execute(
+                        text("SELECT COUNT(*) FROM log WHERE user_id = :id"),
+                        {"id": user_id})
+            except Exception as error:
+                failures.append(error)
+
+    workers = [threading.Thread(target=writer, args=(str(i),)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+
+    return (threads * writes - len(failures)) / elapsed, len(failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=200)
+    args = parser.parse_args()
+
+    for name, tuned in (("default", False), ("tuned", True)):
+        with tempfile.TemporaryDirectory() as folder:
+            rate, failures = run(
+                os.path.join(folder, "bench.db"), tuned, args.threads, args.writes)
+        print(f"{name:8} {rate:10.1f} transactions/s  ({failures} failed)")
+
+
+if __name__ == "__main__":
+    main()
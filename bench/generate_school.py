@@ -0,0 +1,165 @@
+"""builds a database for a realistic (and much bigger than the bundled one) school, for benchmarking.
+The same seed always gives the same school.
+
+Run from the repository root:
+
+    python bench/generate_school.py school.db --students 1200 --staff 120 --groups 60 --years 3
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIRST_NAMES = ["Aroha", "Ben", "Charlotte", "Daniel", "Emma", "Finn", "Grace", "Hemi", "Isla", "Jack",
+               "Kate", "Liam", "Mia", "Noah", "Olivia", "Pita", "Ruby", "Sam", "Tama", "Zoe"]
+LAST_NAMES = ["Anderson", "Brown", "Clark", "Davies", "Edwards", "Fraser", "Green", "Harris", "Jones",
+              "King", "Lee", "Martin", "Ngata", "Parata", "Robinson", "Smith", "Taylor", "Walker", "Wilson"]
+GROUP_NAMES = ["Athletics", "Choir", "Coding Club", "Debating", "Environment", "Hockey", "Kapa Haka",
+               "Library", "Netball", "Orchestra", "Peer Support", "Rowing", "Science Fair", "Tutoring"]
+DESCRIPTIONS = ["Lunchtime practice", "Coaching juniors", "Helped at event", "Fundraising",
+                "Set up and pack down", "Tutoring session", "Beach clean up", "Bake sale"]
+
+# the lookup tables in the bundled database
+ROLES = [(1, "student"), (2, "staff"), (3, "staff")]
+STATUSES = [(1, "Approved"), (2, "Modified"), (3, "Removed")]
+AWARDS = [(1, "Service for Graduation", "#7caa69", 2), (2, "Silver", "#aca9a9", 20),
+          (3, "Gold", "#f8c628", 30), (4, "Platinum", "#4d555f", 40)]
+
+
+def generate(students=1200, staff=120, groups=60, years=3, entries=40, groups_per_student=3, seed=1):
+    """fills the app's database (which should be empty) with a school. Must be run in an app context.
+    Returns a dictionary describing what was made, handy for picking users to benchmark as."""
+    from myserve import db
+    from myserve.models import User, Group, GroupMembers, Log, UserRole, LogStatus, Award, UserWeek
+    from myserve.reports import rebuild_reports
+
+    rng = random.Random(seed)
+    today = datetime.date.today()
+
+    db.session.bulk_insert_mappings(UserRole, [{"id": i, "name": n} for i, n in ROLES])
+    db.session.bulk_insert_mappings(LogStatus, [{"id": i, "name": n} for i, n in STATUSES])
+    db.session.bulk_insert_mappings(Award, [
+        {"id": i, "name": n, "colour": c, "threshold": t} for i, n, c, t in AWARDS])
+
+    staff_ids = [f"T{i:03d}" for i in range(staff)]
+    users = [{
+        "id": user_id,
+        "first_name": rng.choice(FIRST_NAMES),
+        "last_name": rng.choice(LAST_NAMES),
+        "email": f"{user_id.lower()}@bench.school.nz",
+        # every tenth teacher is an admin
+        "role_id": 3 if i % 10 == 0 else 2,
+        "photo": "/static/img/profile-photo-placeholder.jpg",
+    } for i, user_id in enumerate(staff_ids)]
+
+    student_ids = [str(20000 + i) for i in range(students)]
+    form_classes = [f"13{letter}{staff_ids[i % staff][1:]}" for i, letter in enumerate("ABCDEFGHJK")]
+    totals = dict.fromkeys(student_ids, 0.0)
+    users += [{
+        "id": user_id,
+        "first_name": rng.choice(FIRST_NAMES),
+        "last_name": rng.choice(LAST_NAMES),
+        "email": f"{user_id}@bench.school.nz",
+        "form_class": rng.choice(form_classes),
+        "role_id": 1,
+        "photo": "/static/img/profile-photo-placeholder.jpg",
+    } for user_id in student_ids]
+
+    group_ids = list(range(1, groups + 1))
+    db.session.bulk_insert_mappings(Group, [
+        {"id": group_id, "name": f"{GROUP_NAMES[group_id % len(GROUP_NAMES)]} {group_id}"}
+        for group_id in group_ids])
+
+    # group sizes follow a rough power law, so a few clubs are very big
+    weights = [1 / (rank + 1) for rank in range(groups)]
+    memberships = {}
+    for student_id in student_ids:
+        for group_id in set(rng.choices(group_ids, weights, k=groups_per_student)):
+            memberships[(student_id, group_id)] = 0.0
+    teacher_memberships = [{"user_id": rng.choice(staff_ids), "group_id": group_id}
+                           for group_id in group_ids]
+
+    log = []
+    student_groups = {}
+    for student_id, group_id in memberships:
+        student_groups.setdefault(student_id, []).append(group_id)
+    for student_id in student_ids:
+        for _ in range(rng.randint(entries // 2, entries * 3 // 2) * years):
+            date = today - datetime.timedelta(days=rng.randint(0, 365 * years - 1))
+            time = round(rng.choice([0.5, 1, 1, 1.5, 2, 3]), 2)
+            group_id = None
+            teacher_id = None
+            if student_groups.get(student_id) and rng.random() < 0.85:
+                group_id = rng.choice(student_groups[student_id])
+                memberships[(student_id, group_id)] += time
+            else:
+                teacher_id = rng.choice(staff_ids)
+            totals[student_id] += time
+            log.append({
+                "user_id": student_id,
+                "group_id": group_id,
+                "teacher_id": teacher_id,
+                "time": time,
+                "status_id": 1 if rng.random() < 0.9 else 2,
+                "date": date,
+                "log_time": datetime.datetime.combine(date, datetime.time(12)),
+                "description": rng.choice(DESCRIPTIONS),
+            })
+
+    for user in users:
+        if user["role_id"] == 1:
+            user["total"] = totals[user["id"]]
+    db.session.bulk_insert_mappings(User, users)
+    db.session.bulk_insert_mappings(GroupMembers, [
+        {"user_id": user_id, "group_id": group_id, "group_hours": hours}
+        for (user_id, group_id), hours in memberships.items()] + teacher_memberships)
+    for start in range(0, len(log), 10000):
+        db.session.bulk_insert_mappings(Log, log[start:start + 10000])
+    db.session.commit()
+
+    # bulk inserts skip the session events that keep the weekly report rollups
+    # up to date, so they're added up from the log now it's all there
+    rebuild_reports()
+
+    busiest_student = max(student_ids, key=lambda user_id: totals[user_id])
+    return {
+        "students": students,
+        "staff": staff,
+        "groups": groups,
+        "memberships": len(memberships) + len(teacher_memberships),
+        "log_entries": len(log),
+        "user_weeks": UserWeek.query.count(),
+        "student_id": busiest_student,
+        "admin_id": staff_ids[0],
+        "group_id": group_ids[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="where to create the database")
+    parser.add_argument("--students", type=int, default=1200)
+    parser.add_argument("--staff", type=int, default=120)
+    parser.add_argument("--groups", type=int, default=60)
+    parser.add_argument("--years", type=int, default=3, help="years of log history")
+    parser.add_argument("--entries", type=int, default=40,
+                        help="average log entries per student per year")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f"{args.path} already exists")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.abspath(args.path)
+
+    from myserve import app
+    with app.app_context():
+        school = generate(args.students, args.staff, args.groups, args.years, args.entries, seed=args.seed)
+    for key, value in school.items():
+        print(f"{key:12} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""a tiny stand-in for Google's OAuth endpoints so logins can be exercised without the network.
+
+    with MockOAuthServer() as server:
+        os.environ["GOOGLE_DISCOVERY_URL"] = server.discovery_url
+        ...
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOAuthServer:
+    """serves a discovery document, a token endpoint and a userinfo endpoint on localhost"""
+
+    def __init__(self, email="benchmark@example.com", delay=0):
+        self.email = email
+        # optional artificial latency (seconds) to add to every response
+        self.delay = delay
+        self.requests = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def discovery_url(self):
+        return self.base_url + "/.well-known/openid-configuration"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # the headers and body go out in separate writes, so without this each
+            # keep-alive response waits on the client's delayed ACK (~40 ms)
+            disable_nagle_algorithm = True
+
+            def _send(self, payload, cache_control="no-cache"):
+                if mock.delay:
+                    threading.Event().wait(mock.delay)
+                mock.requests += 1
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", cache_control)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.startswith("/.well-known/openid-configuration"):
+                    self._send({
+                        "issuer": mock.base_url,
+                        "authorization_endpoint": mock.base_url + "/authorize",
+                        "token_endpoint": mock.base_url + "/token",
+                        "userinfo_endpoint": mock.base_url + "/userinfo",
+                    }, cache_control="public, max-age=3600")
+                elif self.path.startswith("/userinfo"):
+                    self._send({
+                        "email": mock.email,
+                        "email_verified": True,
+                        "picture": mock.base_url + "/photo.jpg",
+                        "given_name": "Bench",
+                        "family_name": "Mark",
+                    })
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                # read the form body so the connection can be kept alive
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.startswith("/token"):
+                    self._send({
+                        "access_token": "mock-access-token",
+                        "token_type": "Bearer",
+                        "expires_in": 3600,
+                    })
+                else:
+                    self.send_error(404)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
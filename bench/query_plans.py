@@ -0,0 +1,72 @@
+"""prints SQLite's query plan for the app's hottest queries before and after the migrations are applied.
+The bundled database is copied first, so it isn't changed.
+
+Run from the repository root:
+
+    python bench/query_plans.py [path/to/data.db]
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# importing anything from myserve sets up the app, which migrates whatever
+# DATABASE_URL points at. It's pointed at an empty in-memory database so
+# nothing on disk is touched - the migrations are run on the copy below
+os.environ["DATABASE_URL"] = "sqlite://"
+
+from sqlalchemy import create_engine
+from myserve.migrations import upgrade
+
+# (description, query) pairs mirroring the queries issued by models.py
+QUERIES = [
+    ("Group.get_user_log", 'SELECT * FROM log WHERE user_id = ? AND group_id = ?'),
+    ("User.hours", 'SELECT * FROM log WHERE user_id = ?'),
+    ("User.get_hours_responsible", 'SELECT * FROM log WHERE teacher_id = ? AND id > ? ORDER BY id LIMIT 51'),
+    ("User.get_log", 'SELECT * FROM log WHERE user_id = ? AND id > ? ORDER BY id LIMIT 51'),
+    ("Group.hours", 'SELECT * FROM log WHERE group_id = ?'),
+    ("GroupMembers.load", 'SELECT * FROM group_members WHERE user_id = ? AND group_id = ?'),
+    ("Group.get_students", 'SELECT group_members.* FROM group_members JOIN "user" ON "user".user_id = group_members.user_id '
+                           'WHERE group_members.group_id = ? AND "user".role = 1'),
+    ("Leaderboards (school)", 'SELECT user_id, first_name, last_name, form_class, total FROM "user" WHERE role = 1'),
+    ("Leaderboards (group)", 'SELECT group_members.user_id, group_members.group_hours FROM group_members '
+                             'JOIN "user" ON "user".user_id = group_members.user_id '
+                             'WHERE group_members.group_id = ? AND "user".role = 1'),
+    ("User.get_students", 'SELECT * FROM "user" WHERE role = 1 AND (last_name > ? OR (last_name = ? AND first_name > ?) '
+                          'OR (last_name = ? AND first_name = ? AND user_id > ?)) '
+                          'ORDER BY last_name, first_name, user_id LIMIT 51'),
+]
+
+
+def report(connection):
+    for name, query in QUERIES:
+        params = ["x"] * query.count("?")
+        plan = connection.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+        print(f"  {name}")
+        for row in plan:
+            print(f"      {row[-1]}")
+
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join("myserve", "data.db")
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "data.db")
+        shutil.copy(source, path)
+
+        print("before:")
+        with sqlite3.connect(path) as connection:
+            report(connection)
+
+        applied = upgrade(create_engine("sqlite:///" + path))
+        print(f"\napplied migrations: {applied}\n")
+
+        print("after:")
+        with sqlite3.connect(path) as connection:
+            report(connection)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""drives the app's busiest pages through the Flask test client against a generated school and reports
+latency percentiles, queries per request and peak memory, compared with a stored baseline.
+
+Run from the repository root:
+
+    python bench/run_benchmarks.py                    # compare with bench/baseline.json
+    python bench/run_benchmarks.py --save-baseline    # record a new baseline
+
+The exit code is 1 if any page got noticeably slower or makes more queries than the baseline. Background
+jobs run straight away in the request that queues them, so pages like the user import are timed until
+their job has finished.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from generate_school import generate
+
+BASELINE = os.path.join(HERE, "baseline.json")
+
+
+def percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def logged_in_client(app, user_id):
+    """returns a test client that's logged in as a user, skipping the Google login"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = user_id
+        session["_fresh"] = True
+    return client
+
+
+def upload(rows, run):
+    """builds a csv of new students for the import page"""
+    lines = ["User ID,First Name,Last Name,Form Class,Role"]
+    lines += [f"U{run}-{i},Bench,Student{i},13BEN,student" for i in range(rows)]
+    return {"file": (io.BytesIO(("\n".join(lines) + "\n").encode()), "users.csv"), "upload": "Upload"}
+
+
+def check_job(app, response):
+    """makes sure the job a page redirected to finished, as it ran during the request"""
+    from myserve.models import Job
+
+    job_id = int(response.headers["Location"].rstrip("/").rsplit("/", 1)[1])
+    with app.app_context():
+        job = Job.load(job_id)
+        if job.status != "done":
+            raise SystemExit(f"job {job_id} ({job.kind}) {job.status}: {job.error or job.result}")
+
+
+def benchmark(app, school, runs):
+    from flask import url_for
+
+    student = logged_in_client(app, school["student_id"])
+    admin = logged_in_client(app, school["admin_id"])
+
+    # pages that queue a job redirect to it once it's done
+    with app.test_request_context():
+        pages = [
+            ("student.dashboard", student, "get", url_for("student.dashboard"), None, 200),
+            ("student.log", student, "get", url_for("student.log"), None, 200),
+            ("staff.students", admin, "get", url_for("staff.students"), None, 200),
+            ("staff.group_detail", admin, "get", url_for("staff.group_detail", id=school["group_id"]), None, 200),
+            ("staff.other_hours", admin, "get", url_for("staff.other_hours"), None, 200),
+            ("staff.manage_add", admin, "post", url_for("staff.manage_add"), lambda run: upload(100, run), 302),
+        ]
+
+    results = {}
+    for name, client, method, url, make_data, status in pages:
+        timings = []
+        queries = []
+        for run in range(runs + 2):
+            kwargs = {"data": make_data(run), "content_type": "multipart/form-data"} if make_data else {}
+            # the first run warms up the caches and isn't counted, and the
+            # last is only used to measure memory as tracing slows it down
+            if run == runs + 1:
+                tracemalloc.start()
+            start = time.perf_counter()
+            response = getattr(client, method)(url, **kwargs)
+            elapsed = (time.perf_counter() - start) * 1000
+            if response.status_code != status:
+                raise SystemExit(f"{name} returned {response.status_code}")
+            if status == 302:
+                check_job(app, response)
+            if 0 < run <= runs:
+                timings.append(elapsed)
+                queries.append(int(response.headers.get("X-DB-Queries", 0)))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        timings.sort()
+        results[name] = {
+            "p50": round(statistics.median(timings), 2),
+            "p95": round(percentile(timings, 0.95), 2),
+            "p99": round(percentile(timings, 0.99), 2),
+            "queries": max(queries),
+            "peak_kib": round(peak / 1024),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """prints the results next to the baseline, returning the names of any pages that regressed"""
+    regressions = []
+    print(f"{'page':20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'peak KiB':>9}  vs baseline")
+    for name, result in results.items():
+        line = (f"{name:20} {result['p50']:9.2f} {result['p95']:9.2f} {result['p99']:9.2f} "
+                f"{result['queries']:8} {result['peak_kib']:9}")
+        base = baseline.get(name)
+        if base:
+            change = (result["p95"] - base["p95"]) / base["p95"] * 100 if base["p95"] else 0
+            line += f"  p95 {change:+.0f}%, queries {result['queries'] - base['queries']:+}"
+            if change > tolerance * 100 or result["queries"] > base["queries"]:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=30, help="requests per page")
+    parser.add_argument("--students", type=int, default=1200)
+    parser.add_argument("--staff", type=int, default=120)
+    parser.add_argument("--groups", type=int, default=60)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="how much slower (as a fraction) p95 can get before it counts as a regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        # these have to be set before the app is imported
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(folder, "school.db")
+        os.environ["SQL_PROFILE"] = "1"
+        os.environ["SLOW_QUERY_MS"] = "1e9"
+        os.environ["JOB_WORKERS"] = "0"
+
+        from myserve import app
+        app.config["WTF_CSRF_ENABLED"] = False
+
+        with app.app_context():
+            school = generate(args.students, args.staff, args.groups, args.years)
+        print(f"school: {school['students']} students, {school['staff']} staff, "
+              f"{school['groups']} groups, {school['log_entries']} log entries\n")
+
+        results = benchmark(app, school, args.runs)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=4)
+        print(f"\nsaved baseline to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} page(s) regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,69 @@
-from myserve.staff import staff as staff_blueprint
-from myserve.student import student as student_blueprint
-from myserve.auth import auth as auth_blueprint
-from myserve.models import User
+from myserve.migrations import upgrade, REPORTS_VERSION
+from myserve.database import configure_database, configure_engine
+from myserve.profiler import init_profiler
+from myserve.metrics import init_metrics
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from flask_uploads import UploadSet, configure_uploads
 import os
 
 db = SQLAlchemy()
 
 app = Flask(__name__)
 
+# these all use db and app, so they have to be imported after they've been
+# created
+from myserve.models import User
+from myserve.staff import staff as staff_blueprint
+from myserve.student import student as student_blueprint
+from myserve.auth import auth as auth_blueprint
+from myserve.api import api as api_blueprint
+from myserve.commands import register_commands
+from myserve.pagination import page_url
+from myserve.httpcache import init_http_cache
+from myserve.jobs import job_queue
+from myserve.exports import init_exports
+from myserve.reports import rebuild_reports
+
 # set some important variables - we're getting the secret key from the
 # envrionment for security or just generating a random one
 app.secret_key = os.environ.get("SECRET_KEY") or os.urandom(24)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///data.db'
-app.config['UPLOADED_DATA_DEST'] = 'uploads/'
 
+# the database and its connection settings come from the environment, see
+# database.py for the options
+configure_database(app)
 db.init_app(app)
 
+# bring the database schema up to date before we start serving requests. Any
+# tables that are missing (e.g. in a brand new database) are created first
+with app.app_context():
+    configure_engine(db.engine)
+    db.create_all()
+    applied = upgrade(db.engine)
+
+    # the report rollups start off empty, so they're added up from the log
+    # when their tables are first made
+    if REPORTS_VERSION in applied:
+        rebuild_reports()
+
+    # count and time the queries each request makes, if SQL_PROFILE=1
+    init_profiler(app, db.engine)
+
+    # record request latency and throughput, reported at /metrics
+    init_metrics(app, db.engine)
+
 # setup the login manager and where we login users
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
+# the API sends back a 401 rather than redirecting to the login page
+login_manager.blueprint_login_views = {"api": None}
 login_manager.init_app(app)
 
-# setup the object used to store files uploaded
-data = UploadSet(name='data', extensions=('csv'))
-configure_uploads(app, data)
-
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    # the user is usually served from the identity cache without a query
+    return User.load_cached(user_id)
 
 
 # import the routes from the other files
@@ -42,6 +73,23 @@ app.register_blueprint(student_blueprint, url_prefix="/student")
 
 app.register_blueprint(staff_blueprint, url_prefix="/staff")
 
+app.register_blueprint(api_blueprint, url_prefix="/api/v1")
+
+# add our maintenance commands to the flask command line
+register_commands(app)
+
+# used by templates to link to the next and previous pages of a listing
+app.add_template_global(page_url)
+
+# fingerprinted, precompressed static files - see httpcache.py
+init_http_cache(app)
+
+# run imports, user removals and group deletes in the background - see jobs.py
+job_queue.init_app(app)
+
+# csv and Excel downloads of the listings - see exports.py
+init_exports(app)
+
 # let's run the app
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,304 @@
+from flask import Blueprint, abort, jsonify, request
+from flask_login import current_user, login_required
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from myserve.forms import ApiHours
+from myserve.leaderboard import leaderboards
+from myserve.models import USER_ROLE, User, Log, Group, Award
+from myserve.pagination import date_arg
+
+# a JSON version of the student and staff pages for the mobile frontend. It uses the same login
+# session as the rest of the site, and anything that changes data only accepts a JSON body, so other
+# sites can't submit to it the way they could a form.
+api = Blueprint('api', __name__)
+
+
+def serialize_user(user):
+    return {
+        "id": str(user.id),
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "form_class": user.form_class,
+        "role": user.get_role_name(),
+        "total": float(user.total or 0),
+    }
+
+
+def serialize_log(item):
+    return {
+        "id": item.id,
+        "user_id": str(item.user_id),
+        "group_id": item.group_id,
+        "teacher_id": item.teacher_id and str(item.teacher_id),
+        "hours": float(item.time),
+        "description": item.description,
+        "date": item.date.isoformat() if item.date else None,
+        "logged": item.log_time.isoformat() if item.log_time else None,
+        "locked": item.status_id == 2,
+    }
+
+
+def serialize_award(award):
+    return award and {
+        "id": award.id,
+        "name": award.name,
+        "colour": award.colour,
+        "threshold": award.threshold,
+    }
+
+
+def award_progress(user):
+    """where a student is up to with their awards"""
+    next_award = user.get_next_award()
+    total = float(user.total or 0)
+    return {
+        "total": total,
+        "current": serialize_award(user.get_current_award()),
+        "next": serialize_award(next_award),
+        "remaining": max(next_award.threshold - total, 0) if next_award else None,
+    }
+
+
+def user_groups(user):
+    """the groups a user is in, with the hours they've done in each if they're a student"""
+    disabled = set(user.get_disabled_groups())
+    return [{
+        "id": member.group_id,
+        "name": member.group.name,
+        "hours": float(member.group_hours) if member.group_hours is not None else None,
+        "can_leave": member.group_id not in disabled,
+    } for member in user.groups]
+
+
+def select_fields(item):
+    """cuts an item down to the fields asked for with ?fields=a,b,c, so clients only download what they
+    show"""
+    fields = request.args.get("fields")
+    if not fields:
+        return item
+    wanted = set(fields.split(","))
+    return {key: value for key, value in item.items() if key in wanted}
+
+
+def page_response(page, serialize):
+    return jsonify({
+        "items": [select_fields(serialize(item)) for item in page],
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.prev_cursor,
+    })
+
+
+def is_staff():
+    return current_user.is_allowed(USER_ROLE["staff"])
+
+
+def get_json_body():
+    """returns the JSON object sent with a request, or a 400 if there isn't one"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400, description="Please send a JSON object with the Content-Type application/json.")
+    return data
+
+
+def load_item(id):
+    """loads logged hours the current user can see, or 404s. Students can only see their own."""
+    item = Log.load(id)
+    if not item or (not is_staff() and str(item.user_id) != str(current_user.id)):
+        abort(404)
+    return item
+
+
+# the names the API uses for logged hours (as in serialize_log) and the form fields they go in
+HOURS_FIELDS = {
+    "group_id": "group",
+    "teacher_id": "teacher",
+    "hours": "hours",
+    "description": "description",
+    "date": "date",
+}
+
+
+def validate_hours(student, data, item=None):
+    """checks hours sent to the API with the same rules as the add hours form, filling in anything
+    missing from the item being edited. Returns the form, or sends back the errors."""
+    if item is not None:
+        data = {**serialize_log(item), **data}
+    formdata = MultiDict({field: str(data[key]) for key, field in HOURS_FIELDS.items()
+                          if data.get(key) is not None})
+    # hours that weren't done in a group are recorded against a teacher
+    formdata.setdefault("group", "None")
+
+    form = ApiHours(formdata=formdata)
+    form.group.choices = student.get_group_options() + [(None, "No Group")]
+    form.teacher.choices = User.get_teacher_options()
+    if not form.validate():
+        response = jsonify({"error": "Please check the information you've supplied.", "errors": form.errors})
+        response.status_code = 400
+        abort(response)
+    return form
+
+
+@api.errorhandler(HTTPException)
+def json_error(error):
+    """sends errors back as JSON rather than the site's HTML pages"""
+    if error.response is not None:
+        return error.response
+    response = jsonify({"error": error.description})
+    response.status_code = error.code
+    return response
+
+
+@api.after_request
+def add_etag(response):
+    """gives every successful GET a strong ETag from its body, and answers with a 304 (and no body) if the
+    client already has that version. Clients have to check back each time, as the data is per user."""
+    if request.method == "GET" and response.status_code == 200:
+        response.add_etag()
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.make_conditional(request)
+    return response
+
+
+@api.route('/me')
+@login_required
+def me():
+    return jsonify(select_fields(serialize_user(current_user)))
+
+
+@api.route('/awards')
+@login_required
+def awards():
+    data = {"awards": [serialize_award(award) for award in Award.get_awards()]}
+    if current_user.role_id == USER_ROLE["student"]:
+        data["progress"] = award_progress(current_user)
+    return jsonify(data)
+
+
+@api.route('/hours')
+@login_required
+def list_hours():
+    """lists a student's logged hours. Staff can ask for any student with ?user_id=, and everyone can
+    filter with ?date_from= and ?date_to= and page through with ?cursor= and ?page_size="""
+    student = current_user
+    if request.args.get("user_id") and is_staff():
+        student = User.load_by_id(request.args["user_id"]) or abort(404)
+
+    page = student.get_log(
+        date_from=date_arg("date_from"),
+        date_to=date_arg("date_to"),
+        cursor=request.args.get("cursor"),
+        page_size=request.args.get("page_size"))
+    return page_response(page, serialize_log)
+
+
+@api.route('/hours', methods=['POST'])
+@login_required
+def create_hours():
+    if current_user.role_id != USER_ROLE["student"]:
+        abort(403, description="Only students can log hours.")
+
+    form = validate_hours(current_user, get_json_body())
+    item = Log.add_hours(
+        current_user,
+        form.group.data,
+        form.teacher.data,
+        form.hours.data,
+        form.description.data,
+        form.date.data)
+
+    response = jsonify(serialize_log(item))
+    response.status_code = 201
+    return response
+
+
+@api.route('/hours/<int:id>')
+@login_required
+def get_hours(id):
+    return jsonify(select_fields(serialize_log(load_item(id))))
+
+
+@api.route('/hours/<int:id>', methods=['PATCH'])
+@login_required
+def edit_hours(id):
+    """edits logged hours. Only the fields being changed need to be sent. When staff edit hours they're
+    locked, so the student can't change them back."""
+    item = load_item(id)
+    if not is_staff() and item.status_id == 2:
+        abort(403, description="This item has been edited by a staff member.")
+
+    student = User.load_by_id(item.user_id)
+    form = validate_hours(student, get_json_body(), item)
+    item.edit_hours(
+        form.group.data,
+        form.teacher.data,
+        form.hours.data,
+        form.description.data,
+        form.date.data,
+        status=2 if is_staff() else 1)
+    return jsonify(serialize_log(item))
+
+
+@api.route('/hours/<int:id>', methods=['DELETE'])
+@login_required
+def delete_hours(id):
+    item = load_item(id)
+    if not is_staff() and item.status_id == 2:
+        abort(403, description="This item has been edited by a staff member.")
+    item.delete()
+    return "", 204
+
+
+@api.route('/groups')
+@login_required
+def groups():
+    """the groups the user is in, and every group they could join"""
+    return jsonify({
+        "groups": [select_fields(group) for group in user_groups(current_user)],
+        "options": [{"id": id, "name": name} for id, name in Group.get_group_options()],
+    })
+
+
+@api.route('/groups', methods=['PUT'])
+@login_required
+def set_groups():
+    """sets the groups the user is in from a list of group ids, e.g. {"groups": [1, 4]}. Groups they
+    aren't allowed to leave are kept."""
+    group_ids = get_json_body().get("groups")
+    if not isinstance(group_ids, list):
+        abort(400, description="Please send the group ids as a list.")
+
+    valid_ids = {str(id) for id, name in Group.get_group_options()}
+    wanted = {str(id) for id in group_ids}
+    if not wanted <= valid_ids:
+        abort(400, description="One or more of those groups doesn't exist.")
+
+    wanted |= {str(id) for id in current_user.get_disabled_groups()}
+    current_groups = {str(member.group_id) for member in current_user.groups}
+    current_user.join_groups(wanted - current_groups)
+    current_user.leave_groups(current_groups - wanted)
+    return jsonify({"groups": user_groups(current_user)})
+
+
+@api.route('/dashboard')
+@login_required
+def dashboard():
+    """everything the dashboard shows in one call, so the app can load it with a single request"""
+    data = {
+        "user": serialize_user(current_user),
+        "groups": user_groups(current_user),
+    }
+    if current_user.role_id == USER_ROLE["student"]:
+        data["awards"] = award_progress(current_user)
+    else:
+        top_students, _ = leaderboards.top("school", count=5)
+        data["top_students"] = [{
+            "id": entry.user_id,
+            "name": entry.name,
+            "form_class": entry.form_class,
+            "hours": entry.hours,
+            "rank": entry.rank,
+        } for entry in top_students]
+        data["largest_groups"] = [
+            {"id": group.id, "name": group.name, "students": students}
+            for group, students in Group.get_largest_groups(current_user)]
+    return jsonify(data)
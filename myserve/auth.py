@@ -1,4 +1,3 @@
-import json
 from flask import Flask, redirect, request, url_for, Blueprint, render_template, flash
 from flask_login import (
     LoginManager,
@@ -7,10 +6,12 @@ from flask_login import (
     login_user,
     logout_user,
 )
-from oauthlib.oauth2 import WebApplicationClient
-import requests
+from oauthlib.oauth2 import WebApplicationClient, OAuth2Error
+from requests import RequestException
 import os
 from myserve.models import User
+from myserve.oauth import DiscoveryCache, ProviderClient
+from myserve.cache import caches
 
 auth = Blueprint('auth', __name__)
 
@@ -18,15 +19,34 @@ auth = Blueprint('auth', __name__)
 # get the various info we need from the environment for security purposes
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
-GOOGLE_DISCOVERY_URL = (
+GOOGLE_DISCOVERY_URL = os.environ.get(
+    "GOOGLE_DISCOVERY_URL",
     "https://accounts.google.com/.well-known/openid-configuration"
 )
 
 client = WebApplicationClient(GOOGLE_CLIENT_ID)
 
+# one pooled HTTP client is shared by everything that talks to Google so
+# connections are reused between logins
+provider_client = ProviderClient(
+    pool_size=int(os.environ.get("OAUTH_POOL_SIZE", 10)),
+    connect_timeout=float(os.environ.get("OAUTH_CONNECT_TIMEOUT", 3.05)),
+    read_timeout=float(os.environ.get("OAUTH_READ_TIMEOUT", 10)),
+    retries=int(os.environ.get("OAUTH_RETRIES", 3)),
+    backoff=float(os.environ.get("OAUTH_BACKOFF", 0.3)))
+
+# the discovery document hardly ever changes, so we keep a copy of it rather
+# than asking Google for it on every login. Setting GOOGLE_DISCOVERY_FILE
+# points it at a local copy instead, e.g. for testing offline
+google_discovery = DiscoveryCache(
+    GOOGLE_DISCOVERY_URL,
+    local_file=os.environ.get("GOOGLE_DISCOVERY_FILE"),
+    client=provider_client)
+caches["google_discovery"] = google_discovery
+
 
 def get_google_provider_cfg():
-    return requests.get(GOOGLE_DISCOVERY_URL).json()
+    return google_discovery.get()
 
 
 @auth.route('/')
@@ -34,10 +54,18 @@ def index():
     return render_template('auth/index.html')
 
 
+def provider_unreachable():
+    flash("We couldn't reach Google to sign you in. Please try again.", "error")
+    return redirect(url_for("auth.index"))
+
+
 @auth.route("/login")
 def login():
     # find out what URL to hit for Google login
-    google_provider_cfg = get_google_provider_cfg()
+    try:
+        google_provider_cfg = get_google_provider_cfg()
+    except (RequestException, OAuth2Error, ValueError):
+        return provider_unreachable()
     authorization_endpoint = google_provider_cfg["authorization_endpoint"]
 
     # use library to construct the request for Google login and provide
@@ -59,39 +87,44 @@ def callback():
         flash("User email not available or not verified by Google.", "error")
         return redirect(url_for("auth.index"))
 
-    # find out what URL to hit to get tokens that allow you to ask for
-    # things on behalf of a user
-    google_provider_cfg = get_google_provider_cfg()
-    token_endpoint = google_provider_cfg["token_endpoint"]
-
-    # prepare and send request to get tokens
-    token_url, headers, body = client.prepare_token_request(
-        token_endpoint,
-        authorization_response=request.url,
-        redirect_url=request.base_url,
-        code=code,
-    )
-    token_response = requests.post(
-        token_url,
-        headers=headers,
-        data=body,
-        auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
-    )
-
-    # parse the tokens
-    client.parse_request_body_response(json.dumps(token_response.json()))
-
-    # request profile info from Google server.
-    userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
-    uri, headers, body = client.add_token(userinfo_endpoint)
-    userinfo_response = requests.get(uri, headers=headers, data=body)
+    try:
+        # find out what URL to hit to get tokens that allow you to ask for
+        # things on behalf of a user
+        google_provider_cfg = get_google_provider_cfg()
+        token_endpoint = google_provider_cfg["token_endpoint"]
+
+        # prepare and send request to get tokens
+        token_url, headers, body = client.prepare_token_request(
+            token_endpoint,
+            authorization_response=request.url,
+            redirect_url=request.base_url,
+            code=code,
+        )
+        token_response = provider_client.post(
+            token_url,
+            headers=headers,
+            data=body,
+            auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
+        )
+
+        # parse the tokens
+        client.parse_request_body_response(token_response.text)
+
+        # request profile info from Google server.
+        userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
+        uri, headers, body = client.add_token(userinfo_endpoint)
+        userinfo_response = provider_client.get(
+            uri, headers=headers, data=body)
+        userinfo = userinfo_response.json()
+    except (RequestException, OAuth2Error, ValueError):
+        return provider_unreachable()
 
     # get verified user's profil info
-    if userinfo_response.json().get("email_verified"):
-        users_email = userinfo_response.json()["email"]
-        picture = userinfo_response.json()["picture"]
-        first_name = userinfo_response.json()["given_name"]
-        last_name = userinfo_response.json()["family_name"]
+    if userinfo.get("email_verified"):
+        users_email = userinfo["email"]
+        picture = userinfo["picture"]
+        first_name = userinfo["given_name"]
+        last_name = userinfo["family_name"]
     else:
         flash("User email not available or not verified by Google.", "error")
         return redirect(url_for("auth.index"))
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+
+# every cache registers itself here so its hit rate can be reported
+caches = {}
+
+
+class CachedValue:
+    """holds a single value built by a loader function, e.g. a whole table that rarely changes.
+    The value is rebuilt on the next get() after invalidate() is called, or once it is older than
+    ttl seconds - the ttl matters when there are several processes, as invalidating only clears
+    the cache in the process that made the change."""
+
+    def __init__(self, name, loader, ttl=None):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+
+        self._value = None
+        self._loaded = None
+        # bumped every time the cache is invalidated, so a load that started
+        # before an invalidation doesn't get stored
+        self._version = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        caches[name] = self
+
+    def get(self):
+        """returns the cached value, loading it if we don't have a fresh copy"""
+        loaded = self._loaded
+        if loaded is not None and (self.ttl is None or time.monotonic() - loaded < self.ttl):
+            self.hits += 1
+            return self._value
+
+        self.misses += 1
+        version = self._version
+        value = self.loader()
+        with self._lock:
+            if version == self._version:
+                self._value = value
+                self._loaded = time.monotonic()
+        return value
+
+    def invalidate(self):
+        """throws away the cached value so the next get() loads it again"""
+        with self._lock:
+            self._version += 1
+            self._value = None
+            self._loaded = None
+
+    def hit_rate(self):
+        """returns the fraction of get() calls that were served from the cache"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+        }
+
+
+class LRUCache:
+    """a dictionary-like cache that holds at most maxsize items, throwing away the least recently used
+    ones first. Items also expire ttl seconds after they were stored."""
+
+    def __init__(self, name, maxsize=1024, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        caches[name] = self
+
+    def get(self, key):
+        """returns the item stored under key, or None if there isn't a fresh one"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                value, stored = item
+                if self.ttl is None or time.monotonic() - stored < self.ttl:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._items[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic())
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+            "size": len(self._items),
+        }
@@ -0,0 +1,84 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from myserve.httpcache import brotli, compress_static as compress_folder
+from myserve.models import USER_ROLE, Log, User
+from myserve.reports import rebuild_reports as rebuild_rollups
+
+
+@click.command("reconcile-totals")
+@click.option("--fix", is_flag=True, help="Correct any totals that have drifted.")
+@with_appcontext
+def reconcile_totals(fix):
+    """Check stored hour totals against the log."""
+    user_drift, group_drift = Log.reconcile_totals(fix=fix)
+
+    for user_id, stored, actual in user_drift:
+        click.echo(f"user {user_id}: total is {stored}, log adds up to {actual}")
+    for user_id, group_id, stored, actual in group_drift:
+        click.echo(
+            f"user {user_id} in group {group_id}: total is {stored}, log adds up to {actual}")
+
+    if not user_drift and not group_drift:
+        click.echo("All totals match the log.")
+    elif fix:
+        click.echo(f"Fixed {len(user_drift) + len(group_drift)} total(s).")
+
+
+@click.command("remove-users")
+@click.argument("user_ids", nargs=-1)
+@click.option("--role", type=click.Choice(list(USER_ROLE.keys())),
+              help="Remove every user with this role, e.g. the whole year's students.")
+@click.option("--form-class", help="Remove every student in this form class.")
+@click.option("--yes", is_flag=True, help="Don't ask for confirmation.")
+@with_appcontext
+def remove_users(user_ids, role, form_class, yes):
+    """Remove users and all of their hours and group memberships."""
+    query = User.query
+    if user_ids:
+        query = query.filter(User.id.in_(user_ids))
+    if role:
+        query = query.filter(User.role_id == USER_ROLE[role])
+    if form_class:
+        query = query.filter(User.form_class == form_class)
+    if not (user_ids or role or form_class):
+        raise click.UsageError("Give some user IDs, --role or --form-class.")
+
+    selected = [user_id for user_id, in query.with_entities(User.id)]
+    if not selected:
+        click.echo("No users matched.")
+        return
+    if not yes:
+        click.confirm(f"Remove {len(selected)} user(s)? This cannot be undone.", abort=True)
+
+    removed = User.remove_users(selected)
+    click.echo(f"Removed {removed} user(s).")
+
+
+@click.command("compress-static")
+@click.option("--force", is_flag=True, help="Recompress files even if they're up to date.")
+@with_appcontext
+def compress_static(force):
+    """Write precompressed copies of the static files, to run when deploying."""
+    written = compress_folder(current_app.static_folder, force=force)
+    for path in written:
+        click.echo(f"wrote {path}")
+    click.echo(f"Compressed {len(written)} file(s).")
+    if brotli is None:
+        click.echo("Install the brotli package to make .br copies as well.")
+
+
+@click.command("rebuild-reports")
+@with_appcontext
+def rebuild_reports():
+    """Recalculate the weekly report rollups from the log."""
+    count = rebuild_rollups()
+    click.echo(f"Rebuilt the reports from {count} logged item(s).")
+
+
+def register_commands(app):
+    """adds our commands to the flask command line"""
+    app.cli.add_command(reconcile_totals)
+    app.cli.add_command(remove_users)
+    app.cli.add_command(compress_static)
+    app.cli.add_command(rebuild_reports)
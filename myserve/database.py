@@ -0,0 +1,58 @@
+import os
+from sqlalchemy import event
+
+# where the data is stored - this can point at a server database (e.g.
+# postgresql://...) instead of the bundled SQLite file. The bundled file is
+# given by its full path, as Flask-SQLAlchemy 3 looks for relative paths in
+# the instance folder
+DATABASE_URL = os.environ.get(
+    "DATABASE_URL", "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.db"))
+
+# SQLite settings. WAL lets readers carry on while someone is writing, and
+# NORMAL sync is safe in WAL mode while skipping an fsync on every commit
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT = int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+
+# connection pool settings for server databases
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+
+
+def configure_database(app):
+    """sets the database URL and engine options on the app. This needs to happen before db.init_app()."""
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
+
+    if DATABASE_URL.startswith("sqlite"):
+        # sqlite3's own timeout is in seconds, the pragma below covers
+        # connections made outside of SQLAlchemy's connect args
+        options = {"connect_args": {"timeout": SQLITE_BUSY_TIMEOUT / 1000}}
+    else:
+        options = {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            # check connections are still alive before handing them out
+            "pool_pre_ping": True,
+        }
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}).update(options)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """applies our SQLite settings to a new connection"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def configure_engine(engine):
+    """hooks our connection settings into an engine. Must be called before the engine first connects."""
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_pragmas)
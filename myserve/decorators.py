@@ -8,7 +8,7 @@ def permission_required(role_required):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             if not current_user.is_allowed(role_required):
-                return redirect(url_for(current_user.role.name + '.dashboard'))
+                return redirect(url_for(current_user.get_role_name() + '.dashboard'))
             return f(*args, **kwargs)
         return decorated_function
     return decorator
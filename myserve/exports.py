@@ -0,0 +1,197 @@
+import csv
+import io
+import os
+import tempfile
+from datetime import date
+from flask import Response, request, stream_with_context, url_for
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+from myserve import db
+from myserve.models import USER_ROLE, User, Log, LogStatus, Group, GroupMembers, Award
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# how many rows are fetched from the database at a time while exporting, so
+# exports use the same memory however many rows there are
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 1000))
+
+# how much csv is built up before it's sent to the browser
+CSV_CHUNK_BYTES = 64 * 1024
+
+# Excel files can only be made if xlsxwriter is installed
+EXPORT_FORMATS = ("csv", "xlsx") if xlsxwriter is not None else ("csv",)
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# spreadsheets treat cells starting with these as formulas, so a description
+# like "=HYPERLINK(...)" would be run when the export is opened
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def stream_rows(query):
+    """runs a select and yields its rows a chunk at a time, using a server-side cursor where the
+    database has one rather than loading every row first"""
+    result = db.session.execute(query, execution_options={"yield_per": EXPORT_CHUNK_SIZE})
+    for row in result:
+        yield row
+
+
+def safe_cell(value):
+    """stops text from being read as a formula by a spreadsheet"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_chunks(header, rows):
+    """yields a csv file a chunk at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # a byte order mark, so Excel reads names with macrons properly
+    buffer.write("\ufeff")
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow([safe_cell(value) for value in row])
+        if buffer.tell() >= CSV_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def xlsx_chunks(header, rows, sheet_name):
+    """yields an Excel file a chunk at a time. A zip file can't be sent before it's finished, so the
+    rows are written to a temporary file first - in xlsxwriter's constant memory mode, so only one row
+    is held at a time - and the file is streamed from there."""
+    with tempfile.TemporaryFile() as file:
+        workbook = xlsxwriter.Workbook(file, {
+            "constant_memory": True,
+            "default_date_format": "yyyy-mm-dd",
+        })
+        sheet = workbook.add_worksheet(sheet_name[:31])
+        bold = workbook.add_format({"bold": True})
+        sheet.write_row(0, 0, header, bold)
+        for row_no, row in enumerate(rows, 1):
+            for col_no, value in enumerate(row):
+                # strings are always written as text, so they can't be formulas
+                if isinstance(value, str):
+                    sheet.write_string(row_no, col_no, value)
+                elif value is not None:
+                    sheet.write(row_no, col_no, value)
+        workbook.close()
+
+        file.seek(0)
+        while True:
+            chunk = file.read(CSV_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def export_response(name, header, rows, format):
+    """streams rows to the browser as a csv or Excel download. The rows are generated while the response
+    is sent, inside the request so the database session is still there."""
+    if format == "xlsx":
+        chunks = xlsx_chunks(header, rows, name)
+    else:
+        chunks = csv_chunks(header, rows)
+    response = Response(stream_with_context(chunks), mimetype=MIMETYPES[format])
+    response.headers["Content-Disposition"] = f'attachment; filename="{name}-{date.today().isoformat()}.{format}"'
+    return response
+
+
+def export_url(endpoint, format, **values):
+    """the url of an export, keeping the filters of the page it's linked from (but not which page of
+    the listing it was on)"""
+    args = request.args.to_dict()
+    args.pop("cursor", None)
+    args.pop("page_size", None)
+    args.update(values)
+    return url_for(endpoint, format=format, **args)
+
+
+def student_totals(search=None, form_class=None):
+    """every student's total hours and current award"""
+    query = select(
+        User.id, User.first_name, User.last_name, User.form_class, User.total).where(
+        User.role_id == USER_ROLE["student"]).order_by(
+        User.last_name, User.first_name, User.id)
+    if search:
+        query = query.where(User.search_filter(search))
+    if form_class:
+        query = query.where(User.form_class == form_class)
+
+    award_table = Award.get_award_table()
+    for user_id, first_name, last_name, user_form_class, total in stream_rows(query):
+        award = Award.find_award(award_table, total)
+        yield user_id, first_name, last_name, user_form_class, float(total or 0), award.name if award else ""
+
+
+STUDENT_TOTALS_HEADER = ("Student ID", "First Name", "Last Name", "Form Class", "Total Hours", "Current Award")
+
+
+def hours_history(student_id=None, group_id=None, teacher_id=None, search=None, form_class=None,
+                  date_from=None, date_to=None):
+    """logged hours in the order they were logged, with the student, group and teacher's names"""
+    teacher = aliased(User)
+    query = select(
+        Log.id, Log.date, User.id, User.first_name, User.last_name, User.form_class, Group.name,
+        teacher.first_name, teacher.last_name, Log.time, Log.description, LogStatus.name,
+        Log.log_time).join(
+        User, Log.user_id == User.id).outerjoin(
+        Group, Log.group_id == Group.id).outerjoin(
+        teacher, Log.teacher_id == teacher.id).outerjoin(
+        LogStatus, Log.status_id == LogStatus.id).order_by(
+        Log.id)
+    if student_id:
+        query = query.where(Log.user_id == student_id)
+    if group_id:
+        query = query.where(Log.group_id == group_id)
+    if teacher_id:
+        query = query.where(Log.teacher_id == teacher_id)
+    if search:
+        query = query.where(User.search_filter(search))
+    if form_class:
+        query = query.where(User.form_class == form_class)
+    query = Log.filter_dates(query, date_from, date_to)
+
+    for (id, work_date, user_id, first_name, last_name, user_form_class, group_name, teacher_first,
+         teacher_last, time, description, status, log_time) in stream_rows(query):
+        teacher_name = " ".join(filter(None, (teacher_first, teacher_last)))
+        yield (id, work_date, user_id, first_name, last_name, user_form_class, group_name or "Other",
+               teacher_name, float(time or 0), description, status, log_time)
+
+
+HOURS_HISTORY_HEADER = ("Log ID", "Date Completed", "Student ID", "First Name", "Last Name", "Form Class",
+                        "Group", "Teacher", "Hours", "Description", "Status", "Logged At")
+
+
+def group_hours(group, search=None):
+    """the hours each student in a group has done in it"""
+    query = select(
+        User.id, User.first_name, User.last_name, User.form_class, GroupMembers.group_hours).select_from(
+        GroupMembers).join(
+        GroupMembers.user).where(
+        GroupMembers.group_id == group.id,
+        User.role_id == USER_ROLE["student"]).order_by(
+        User.last_name, User.first_name, User.id)
+    if search:
+        query = query.where(User.search_filter(search))
+
+    for user_id, first_name, last_name, form_class, hours in stream_rows(query):
+        yield user_id, first_name, last_name, form_class, float(hours or 0)
+
+
+GROUP_HOURS_HEADER = ("Student ID", "First Name", "Last Name", "Form Class", "Group Hours")
+
+
+def init_exports(app):
+    """lets templates link to the exports"""
+    app.add_template_global(export_url)
+    app.add_template_global(EXPORT_FORMATS, "export_formats")
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired, FileAllowed
-from wtforms import SelectField, TextField, DecimalField, DateField, SubmitField, SelectMultipleField, widgets
+from wtforms import SelectField, StringField, DecimalField, DateField, SubmitField, SelectMultipleField, widgets
 from wtforms.validators import DataRequired, Length, ValidationError, NumberRange
 import datetime
 
@@ -22,7 +22,7 @@ def validate_date(form, field):
 
 
 class AddHours(FlaskForm):
-    description = TextField('Description', validators=[DataRequired(), Length(
+    description = StringField('Description', validators=[DataRequired(), Length(
         max=100, message="Please enter a description with less than 100 characters.")])
     hours = DecimalField(
         'Hours',
@@ -58,7 +58,7 @@ class JoinGroups(FlaskForm):
 
 
 class CreateGroup(FlaskForm):
-    name = TextField(
+    name = StringField(
         'Group Name',
         validators=[
             DataRequired(),
@@ -77,3 +77,34 @@ class UserUpload(FlaskForm):
                 ['csv'],
                 'Please upload a .csv file.')])
     upload = SubmitField("Upload", validators=[])
+
+
+class RemoveUsers(FlaskForm):
+    remove = SubmitField("Remove Selected")
+
+
+class JobAction(FlaskForm):
+    retry = SubmitField("Retry")
+    cancel = SubmitField("Cancel")
+
+
+class ApiHours(AddHours):
+    """the same checks as AddHours for hours sent to the JSON API, which sends dates as YYYY-MM-DD.
+    There's no CSRF token, as the API only accepts JSON bodies, which other sites can't send."""
+    class Meta:
+        csrf = False
+
+    date = DateField(
+        'Date Completed',
+        format='%Y-%m-%d',
+        validators=[
+            DataRequired(
+                message="Please enter a valid date in the format yyyy-mm-dd."),
+            validate_date])
+    # the teacher only needs to be sent for hours that weren't done in a group
+    teacher = SelectField("Teacher", validate_choice=False)
+
+    def validate_teacher(self, field):
+        if self.group.data == "None" and field.data not in [str(id) for id, name in field.choices]:
+            raise ValidationError(
+                "Please choose the teacher responsible for hours not done in a group.")
@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from functools import wraps
+from flask import current_app, make_response, request, send_from_directory, session, url_for
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# fingerprinted static files never change at the same url, so browsers can keep them for a year
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+# only text files are worth precompressing - images are already compressed
+COMPRESSIBLE = (".css", ".js", ".csv", ".svg", ".txt", ".json", ".html")
+
+# filename -> (mtime, short content hash) so each static file is only hashed once
+_hashes = {}
+
+
+def file_hash(path):
+    """returns a short hash of a file's contents, rehashing it only if it has been modified"""
+    mtime = os.path.getmtime(path)
+    cached = _hashes.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as file:
+            cached = _hashes[path] = (mtime, hashlib.sha256(file.read()).hexdigest()[:12])
+    return cached[1]
+
+
+def static_url(filename):
+    """returns the url of a static file with a hash of its contents in it, so a new version of the file
+    gets a new url and the old one can be cached forever"""
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        version = file_hash(path)
+    except OSError:
+        return url_for("static", filename=filename)
+    return url_for("static", filename=filename, v=version)
+
+
+def serve_static(filename):
+    """serves a static file, using a precompressed copy made by `flask compress-static` if the browser
+    accepts it. Fingerprinted urls (from static_url) are marked as never changing."""
+    folder = current_app.static_folder
+    original = safe_join(folder, filename)
+    response = None
+    for encoding, extension in (("br", ".br"), ("gzip", ".gz")):
+        if original is None or not os.path.isfile(original) or not request.accept_encodings[encoding]:
+            continue
+        # make sure the compressed copy isn't left over from an older version of the file
+        compressed = original + extension
+        if os.path.isfile(compressed) and os.path.getmtime(compressed) >= os.path.getmtime(original):
+            mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            response = send_from_directory(folder, filename + extension, mimetype=mimetype)
+            response.headers["Content-Encoding"] = encoding
+            break
+
+    if response is None:
+        response = send_from_directory(folder, filename)
+    response.vary.add("Accept-Encoding")
+
+    if request.args.get("v"):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def compress_static(folder, force=False):
+    """writes .gz (and .br, if the brotli package is installed) copies of the text files in a folder,
+    returning the paths written. Files whose compressed copies are up to date are skipped."""
+    written = []
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as file:
+                data = file.read()
+
+            variants = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append((".br", lambda data: brotli.compress(data, quality=11)))
+            for extension, compress in variants:
+                target = path + extension
+                if not force and os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+                compressed = compress(data)
+                # there's no point serving a "compressed" copy that's bigger
+                if len(compressed) >= len(data):
+                    continue
+                with open(target, "wb") as file:
+                    file.write(compressed)
+                written.append(target)
+    return written
+
+
+def conditional_page(state):
+    """caches a read-only page in the browser. state is called with the view's arguments and returns a
+    version of the data the page shows - e.g. a count of the rows and their total. If the browser already
+    has that version of the page we send back a 304 without rendering it. The version is combined with
+    the url and the logged in user's details, as those are on every page.
+    Only an ETag is sent, not Last-Modified: the newest row's time goes backwards when that row is
+    deleted, so If-Modified-Since would get a 304 for a page that had changed."""
+    def decorator(view):
+        @wraps(view)
+        def decorated_function(*args, **kwargs):
+            # pages showing a flashed message can't be cached, as the message only shows once
+            if request.method != "GET" or session.get("_flashes"):
+                return view(*args, **kwargs)
+
+            version = state(*args, **kwargs)
+            user = (current_user.get_id(), current_user.first_name, current_user.last_name, current_user.photo)
+            etag = hashlib.sha1(repr((request.full_path, user, version)).encode()).hexdigest()
+
+            if not is_resource_modified(request.environ, etag=etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                # e.g. a redirect because the page doesn't exist
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # the page is only for this user, and has to be checked with us each time
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
+
+
+def init_http_cache(app):
+    """swaps in our static file view and adds static_url() to the templates"""
+    app.view_functions["static"] = serve_static
+    app.add_template_global(static_url)
@@ -0,0 +1,96 @@
+import csv
+import io
+import os
+import uuid
+from itertools import islice
+from myserve import db
+from myserve.models import User, forget_options, mark_rankings_stale
+
+# how many rows are checked and inserted at a time
+CHUNK_SIZE = 500
+
+
+def save_upload(upload, folder):
+    """copies an uploaded file into a folder a chunk at a time, so it can be imported (and retried) from
+    there without ever being held in memory. Returns the file's path and how many rows it has, not
+    counting the header row."""
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{uuid.uuid4().hex}.csv")
+    upload.save(path)
+    with open(path, "rb") as file:
+        rows = sum(1 for line in file) - 1
+    return path, max(rows, 0)
+
+
+def read_rows(stream):
+    """reads an uploaded csv a row at a time straight from the upload, skipping the header row.
+    Yields (line no, row) pairs with the line numbers counted the way a spreadsheet shows them."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    next(reader, None)
+    for line_no, row in enumerate(reader, start=2):
+        yield line_no, row
+
+
+def import_users(stream, chunk_size=CHUNK_SIZE, progress=None):
+    """adds the users in an uploaded csv to the database. The file is processed in chunks so it never has
+    to be held in memory all at once, and each chunk's IDs are checked against the database in one query.
+    Everything happens in one transaction: if any row has errors, none of the users are added.
+    progress is called with the number of rows processed after each chunk.
+    Returns the number of rows processed and a list of (line no, [errors]) tuples."""
+    errors = []
+    num_users = 0
+    seen_ids = set()
+    rows = read_rows(stream)
+
+    try:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            num_users += len(chunk)
+
+            # look up which of the chunk's ids are already taken all at once
+            existing_ids = User.get_existing_ids(
+                [row[0] for line_no, row in chunk if len(row) == 5 and row[0]])
+
+            new_users = []
+            for line_no, row_data in chunk:
+                # check that they haven't left out info or added extra
+                if len(row_data) != 5:
+                    errors.append(
+                        (line_no,
+                         [f"The user at line {line_no} was missing required information. Please ensure that you have at least entered the user's ID, email and role."]))
+                    continue
+
+                user_id = row_data[0]
+                id_taken = user_id in existing_ids or user_id in seen_ids
+                seen_ids.add(user_id)
+
+                details, user_errors = User.check_new_user(
+                    user_id, row_data[1], row_data[2], row_data[3], row_data[4], id_taken=id_taken)
+                if user_errors:
+                    errors.append((line_no, user_errors))
+                else:
+                    new_users.append(details)
+
+            # once there's an error nothing will be saved, so we just keep
+            # checking the rest of the file for the user
+            if not errors and new_users:
+                db.session.bulk_insert_mappings(User, new_users)
+            if progress:
+                progress(num_users)
+
+    except (UnicodeDecodeError, csv.Error):
+        db.session.rollback()
+        return num_users, [(num_users + 2, ["The file couldn't be read. Please make sure it is a .csv file saved as UTF-8."])]
+
+    # if all of our users have been valid, then we can commit the changes to
+    # the db, otherwise we want to cancel the changes
+    if errors:
+        db.session.rollback()
+    else:
+        forget_options()
+        mark_rankings_stale()
+        db.session.commit()
+    return num_users, errors
@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import text
+from myserve import db
+from myserve.imports import import_users
+from myserve.metrics import process_alive
+from myserve.models import Job, Group, User
+
+# how many jobs run at once. SQLite only lets one connection write at a time,
+# so more than one worker rarely helps. Set it to 0 to run each job straight
+# away in the request that queues it, which is handy when testing locally
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 1))
+
+# what each kind of job is called on the jobs page
+JOB_NAMES = {
+    "import_users": "Import users",
+    "remove_users": "Remove users",
+    "delete_group": "Delete group",
+}
+
+
+class JobCancelled(Exception):
+    """raised inside a job once it has been cancelled, so its transaction is rolled back"""
+
+
+def run_import_users(job, progress):
+    path = job.get_params()["path"]
+    with open(path, "rb") as file:
+        num_users, errors = import_users(file, progress=progress)
+    # the file is kept until the users are in, so a failed import can be retried
+    if not errors:
+        os.remove(path)
+    return {"users": num_users, "errors": errors}
+
+
+def run_remove_users(job, progress):
+    removed = User.remove_users(job.get_params()["user_ids"], progress=progress)
+    return {"removed": removed}
+
+
+def run_delete_group(job, progress):
+    group = Group.load(job.get_params()["group_id"])
+    if group is None:
+        raise ValueError("That group has already been deleted.")
+    name = group.name
+    counts = group.delete()
+    return dict(counts, name=name)
+
+
+# each handler takes the job and a progress function to call with the number of
+# rows done, and returns a dictionary of results. A result with "errors" in it
+# marks the job as failed
+HANDLERS = {
+    "import_users": run_import_users,
+    "remove_users": run_remove_users,
+    "delete_group": run_delete_group,
+}
+
+
+class JobQueue:
+    """runs jobs on a pool of background threads in this process, with no broker needed. Jobs are stored
+    in the job table, so queued jobs are picked up again after a restart, and every process can see
+    them. A job is claimed with an UPDATE before it runs, so it only runs once even when several
+    processes try to start it."""
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self._app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        # held while a job is claimed and while recover() looks for stuck jobs, so a job that's just
+        # been claimed is always in progress before recover() can see it running
+        self._claim_lock = threading.Lock()
+        # job id -> rows done, for the jobs running in this process. It isn't written to the
+        # database until the job finishes, as the job's own transaction holds the write lock.
+        self.progress = {}
+
+    def init_app(self, app):
+        """sets the queue up for an app, picking up any jobs left over from before it started"""
+        self._app = app
+        with app.app_context():
+            self.recover()
+
+    def enqueue(self, kind, params=None, payload=None, total=None, user=None):
+        """stores a new job and starts it as soon as a worker is free, returning the job"""
+        job = Job.create(kind, params, payload, total, user)
+        self.submit(job.id)
+        return job
+
+    def submit(self, job_id):
+        if self.workers <= 0:
+            self.run(job_id)
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="myserve-job")
+        self._executor.submit(self.run, job_id)
+
+    def run(self, job_id):
+        """runs a job in its own app context (and so its own database session)"""
+        with self._app.app_context():
+            try:
+                self._run(job_id)
+            finally:
+                db.session.remove()
+
+    def _run(self, job_id):
+        with self._claim_lock:
+            claimed = Job.query.filter(Job.id == job_id, Job.status == "queued").update({
+                Job.status: "running",
+                Job.started: datetime.now(),
+                Job.worker_pid: os.getpid(),
+                Job.attempts: Job.attempts + 1,
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                self.progress[job_id] = 0
+        if not claimed:
+            return
+
+        job = Job.load(job_id)
+        update = {}
+        try:
+            result = HANDLERS[job.kind](job, lambda done: self._report(job_id, done))
+        except JobCancelled:
+            db.session.rollback()
+            update[Job.status] = "cancelled"
+        except Exception as error:
+            db.session.rollback()
+            self._app.logger.exception("job %s (%s) failed", job_id, job.kind)
+            update[Job.status] = "failed"
+            update[Job.error] = str(error) or error.__class__.__name__
+        else:
+            update[Job.status] = "failed" if result.get("errors") else "done"
+            update[Job.result] = json.dumps(result)
+        finally:
+            update[Job.progress] = self.progress.pop(job_id, 0)
+            update[Job.finished] = datetime.now()
+
+        Job.query.filter(Job.id == job_id).update(update, synchronize_session=False)
+        db.session.commit()
+
+    def _report(self, job_id, done):
+        """records a job's progress, stopping it if it has been cancelled. The cancel flag is read on its
+        own connection, as the job's connection can't see changes made since its transaction started."""
+        self.progress[job_id] = done
+        with db.engine.connect() as connection:
+            cancelled = connection.execute(
+                text("SELECT cancel_requested FROM job WHERE id = :id"), {"id": job_id}).scalar()
+        if cancelled:
+            raise JobCancelled()
+
+    def get_progress(self, job):
+        """how many rows a job has done, live if it's running in this process"""
+        return self.progress.get(job.id, job.progress or 0)
+
+    def cancel(self, job):
+        """cancels a queued job straight away, or asks a running one to stop after its current chunk"""
+        cancelled = Job.query.filter(Job.id == job.id, Job.status == "queued").update({
+            Job.status: "cancelled",
+            Job.finished: datetime.now(),
+        }, synchronize_session=False)
+        if not cancelled:
+            Job.query.filter(Job.id == job.id, Job.status == "running").update(
+                {Job.cancel_requested: True}, synchronize_session=False)
+        db.session.commit()
+
+    def retry(self, job):
+        """queues a failed or cancelled job to run again"""
+        retried = Job.query.filter(Job.id == job.id, Job.status.in_(("failed", "cancelled"))).update({
+            Job.status: "queued",
+            Job.result: None,
+            Job.error: None,
+            Job.progress: 0,
+            Job.cancel_requested: False,
+            Job.started: None,
+            Job.finished: None,
+        }, synchronize_session=False)
+        db.session.commit()
+        if retried:
+            self.submit(job.id)
+        return bool(retried)
+
+    def recover(self):
+        """marks jobs that are stuck as running as failed (so they can be retried), and starts queued
+        jobs. A job is stuck if the process running it has died, or if it was running in this process
+        but its thread has stopped. This runs when the queue starts and whenever the jobs page is
+        opened, so jobs that get stuck later are found too."""
+        with self._claim_lock:
+            running = Job.query.filter(Job.status == "running").all()
+            for job in running:
+                if job.worker_pid == os.getpid():
+                    stuck = job.id not in self.progress
+                else:
+                    stuck = not process_alive(job.worker_pid)
+                if stuck:
+                    job.status = "failed"
+                    job.error = "The job stopped before it finished, e.g. because the server was restarted."
+                    job.finished = datetime.now()
+            db.session.commit()
+
+        queued = [job_id for job_id, in db.session.query(Job.id).filter(Job.status == "queued")]
+        for job_id in queued:
+            self.submit(job_id)
+
+
+job_queue = JobQueue()
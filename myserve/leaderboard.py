@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from myserve import db
+from myserve.models import USER_ROLE, User, GroupMembers
+
+# how long (in seconds) a process keeps its leaderboards before rebuilding them
+# from the database. Changes made by this process are applied straight away,
+# this just picks up changes made by other processes
+LEADERBOARD_TTL = int(os.environ.get("LEADERBOARD_TTL", 300))
+
+# when more students than this change in one commit (e.g. a group being
+# deleted), their ranking is re-sorted once instead of moving them one by one
+RESORT_BATCH_SIZE = 50
+
+LeaderboardEntry = namedtuple(
+    "LeaderboardEntry", ["rank", "user_id", "name", "form_class", "hours"])
+
+
+class Ranking:
+    """a list of students kept sorted by hours (highest first), so the top students and any student's rank
+    can be found in O(log n). Hours can be changed one student at a time without re-sorting everything.
+    Moving a student shifts the list along, which is O(n), but for a school-sized list (a few thousand
+    students) that's a few microseconds - much less than the commit that changed their hours."""
+
+    def __init__(self, hours=None):
+        # user id -> hours, and a sorted list of (-hours, user id) keys
+        self._hours = dict(hours or {})
+        self._keys = sorted((-total, user_id) for user_id, total in self._hours.items())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, user_id):
+        return user_id in self._hours
+
+    def set(self, user_id, hours):
+        """sets a student's hours, adding them if they aren't already in the ranking"""
+        if user_id in self._hours:
+            self.remove(user_id)
+        self._hours[user_id] = hours
+        insort(self._keys, (-hours, user_id))
+
+    def add_many(self, differences):
+        """adds (or subtracts) hours from several students in the ranking at once, given a dictionary of
+        user id -> difference. Big batches are re-sorted in one go."""
+        differences = {user_id: difference for user_id, difference in differences.items()
+                       if user_id in self._hours}
+        if len(differences) <= RESORT_BATCH_SIZE:
+            for user_id, difference in differences.items():
+                self.set(user_id, self._hours[user_id] + difference)
+            return
+        for user_id, difference in differences.items():
+            self._hours[user_id] += difference
+        self._keys = sorted((-total, user_id) for user_id, total in self._hours.items())
+
+    def remove(self, user_id):
+        hours = self._hours.pop(user_id)
+        del self._keys[bisect_left(self._keys, (-hours, user_id))]
+
+    def hours(self, user_id):
+        return self._hours.get(user_id)
+
+    def rank(self, user_id):
+        """returns a student's rank (1 is the top). Students with the same hours share a rank."""
+        if user_id not in self._hours:
+            return None
+        # count everyone with strictly more hours
+        return bisect_left(self._keys, (-self._hours[user_id],)) + 1
+
+    def top(self, count, offset=0):
+        """returns (rank, user id, hours) tuples for a slice of the ranking"""
+        return [(self.rank(user_id), user_id, -hours)
+                for hours, user_id in self._keys[offset:offset + count]]
+
+
+class Leaderboards:
+    """the school-wide, per form class and per group rankings. The school and form class rankings are
+    built together from one query, and each group's ranking is built from one query the first time it's
+    needed. After that they're kept up to date by the hours changes committed in this process."""
+
+    def __init__(self, ttl=LEADERBOARD_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._built = None
+        self._school = None
+        self._forms = {}
+        self._groups = {}
+        # user id -> (name, form class) for displaying the rankings
+        self._students = {}
+
+    def invalidate(self):
+        """throws the rankings away so they're rebuilt from the database next time they're used"""
+        with self._lock:
+            self._reset()
+
+    def _ensure_built(self):
+        if self._built is not None and time.monotonic() - self._built < self.ttl:
+            return
+        self._reset()
+
+        rows = db.session.query(
+            User.id, User.first_name, User.last_name, User.form_class, User.total).filter(
+            User.role_id == USER_ROLE["student"])
+
+        school = {}
+        forms = {}
+        for user_id, first_name, last_name, form_class, total in rows:
+            user_id = str(user_id)
+            hours = float(total or 0)
+            school[user_id] = hours
+            forms.setdefault(form_class, {})[user_id] = hours
+            self._students[user_id] = (f"{first_name} {last_name}", form_class)
+
+        self._school = Ranking(school)
+        self._forms = {form_class: Ranking(hours) for form_class, hours in forms.items()}
+        self._built = time.monotonic()
+
+    def _get_ranking(self, scope):
+        """returns the ranking for a scope: "school", ("form", form class) or ("group", group id)"""
+        self._ensure_built()
+        if scope == "school":
+            return self._school
+
+        kind, key = scope
+        if kind == "form":
+            return self._forms.get(key, Ranking())
+
+        group_id = int(key)
+        if group_id not in self._groups:
+            rows = db.session.query(
+                GroupMembers.user_id, GroupMembers.group_hours).join(
+                GroupMembers.user).filter(
+                GroupMembers.group_id == group_id,
+                User.role_id == USER_ROLE["student"])
+            self._groups[group_id] = Ranking(
+                {str(user_id): float(hours or 0) for user_id, hours in rows})
+        return self._groups[group_id]
+
+    def _entries(self, ranking, rows):
+        return [LeaderboardEntry(rank, user_id, *self._students.get(user_id, (user_id, None)), hours)
+                for rank, user_id, hours in rows]
+
+    def top(self, scope="school", count=5, offset=0):
+        """returns a page of a ranking as LeaderboardEntry tuples, along with the size of the ranking"""
+        with self._lock:
+            ranking = self._get_ranking(scope)
+            return self._entries(ranking, ranking.top(count, offset)), len(ranking)
+
+    def rank(self, user_id, scope="school"):
+        """returns a student's LeaderboardEntry in a ranking, or None if they aren't in it"""
+        user_id = str(user_id)
+        with self._lock:
+            ranking = self._get_ranking(scope)
+            if user_id not in ranking:
+                return None
+            return self._entries(ranking, [(ranking.rank(user_id), user_id, ranking.hours(user_id))])[0]
+
+    def form_classes(self):
+        with self._lock:
+            self._ensure_built()
+            return sorted(form_class for form_class in self._forms if form_class)
+
+    def apply(self, totals_changed, group_hours_changed):
+        """applies a commit's changes to students' hours to the rankings that have been built. The changes
+        are added up for each ranking first, so each ranking is updated once per commit."""
+        with self._lock:
+            if self._built is None:
+                return
+            school = {}
+            forms = {}
+            for user_id, difference in totals_changed:
+                user_id = str(user_id)
+                school[user_id] = school.get(user_id, 0) + float(difference)
+                form_class = self._students.get(user_id, (None, None))[1]
+                if form_class in self._forms:
+                    form = forms.setdefault(form_class, {})
+                    form[user_id] = form.get(user_id, 0) + float(difference)
+            groups = {}
+            for user_id, group_id, difference in group_hours_changed:
+                if int(group_id) in self._groups:
+                    group = groups.setdefault(int(group_id), {})
+                    group[str(user_id)] = group.get(str(user_id), 0) + float(difference)
+
+            self._school.add_many(school)
+            for form_class, differences in forms.items():
+                self._forms[form_class].add_many(differences)
+            for group_id, differences in groups.items():
+                self._groups[group_id].add_many(differences)
+
+
+leaderboards = Leaderboards()
+
+
+@event.listens_for(Session, "after_commit")
+def update_leaderboards(session):
+    """once hours changes are committed, applies them to the leaderboards (or rebuilds the leaderboards
+    if students or memberships were added or removed in bulk)"""
+    totals_changed = session.info.pop("totals_changed", [])
+    group_hours_changed = session.info.pop("group_hours_changed", [])
+    if session.info.pop("rankings_stale", False):
+        leaderboards.invalidate()
+    elif totals_changed or group_hours_changed:
+        leaderboards.apply(totals_changed, group_hours_changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_hours_changes(session):
+    session.info.pop("totals_changed", None)
+    session.info.pop("group_hours_changed", None)
+    session.info.pop("rankings_stale", None)
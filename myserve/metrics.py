@@ -0,0 +1,258 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, g, request
+from myserve.cache import caches
+
+# upper bounds (in seconds) of the request latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# when running several worker processes (e.g. gunicorn), set this to a folder
+# they can all write to and /metrics will add up every worker's numbers
+METRICS_DIR = os.environ.get("METRICS_DIR")
+# how often (in seconds) each worker writes its numbers to METRICS_DIR
+SNAPSHOT_INTERVAL = 1.0
+
+# Every thread records into its own shard, so recording a request never
+# needs a lock - the shards are only added together when /metrics is read.
+# A shard maps endpoint -> [requests by status..., histogram counts..., sum]
+# as described in _new_stats(). The development server starts a thread for
+# each request, so once a thread has exited its shard is added into _retired
+# and dropped, rather than being kept forever
+_shards = {}
+_shards_lock = threading.Lock()
+_retired = {"endpoints": {}, "in_flight": 0}
+_local = threading.local()
+_engine = None
+_last_snapshot = 0
+
+
+def _get_shard():
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        shard = _local.shard = {"endpoints": {}, "in_flight": 0}
+        with _shards_lock:
+            _retire_shards()
+            _shards[threading.current_thread()] = shard
+    return shard
+
+
+def _retire_shards():
+    """adds the shards of threads that have exited into _retired. Their threads can't write to them any
+    more, so they're safe to read. Call this with _shards_lock held."""
+    for thread in [thread for thread in _shards if not thread.is_alive()]:
+        _add_endpoints(_retired["endpoints"], _shards.pop(thread)["endpoints"])
+
+
+def _new_stats():
+    """the numbers we keep for each endpoint: a dictionary of status code counts, the count for each
+    histogram bucket (plus one for anything slower than the last bucket) and the total time taken"""
+    return {"status": {}, "buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0}
+
+
+def _add_endpoints(totals, endpoints):
+    """adds one set of endpoint numbers into another"""
+    for endpoint, stats in list(endpoints.items()):
+        total = totals.setdefault(endpoint, _new_stats())
+        for status, count in list(stats["status"].items()):
+            total["status"][str(status)] = total["status"].get(str(status), 0) + count
+        total["buckets"] = [a + b for a, b in zip(total["buckets"], stats["buckets"])]
+        total["sum"] += stats["sum"]
+
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+    _get_shard()["in_flight"] += 1
+
+
+def record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def finish_request(exception=None):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+
+    shard = _get_shard()
+    shard["in_flight"] -= 1
+
+    # request.endpoint is an existing string, so no label text is built here
+    endpoint = request.endpoint or "unmatched"
+    stats = shard["endpoints"].get(endpoint)
+    if stats is None:
+        stats = shard["endpoints"][endpoint] = _new_stats()
+
+    status = g.pop("metrics_status", 500)
+    stats["status"][status] = stats["status"].get(status, 0) + 1
+    stats["buckets"][bisect_left(BUCKETS, elapsed)] += 1
+    stats["sum"] += elapsed
+
+    if METRICS_DIR and time.monotonic() - _last_snapshot > SNAPSHOT_INTERVAL:
+        write_snapshot()
+
+
+def collect():
+    """adds up the numbers from every thread in this process into one snapshot"""
+    endpoints = {}
+    in_flight = 0
+    with _shards_lock:
+        _retire_shards()
+        for shard in [_retired, *_shards.values()]:
+            in_flight += shard["in_flight"]
+            _add_endpoints(endpoints, shard["endpoints"])
+
+    pool = {}
+    if _engine is not None and hasattr(_engine.pool, "checkedout"):
+        pool = {
+            "checked_out": _engine.pool.checkedout(),
+            "size": _engine.pool.size(),
+            "overflow": _engine.pool.overflow(),
+        }
+
+    return {
+        "pid": os.getpid(),
+        "endpoints": endpoints,
+        "in_flight": in_flight,
+        "pool": pool,
+        "caches": {name: [cache.hits, cache.misses] for name, cache in list(caches.items())},
+    }
+
+
+def write_snapshot():
+    """writes this process's numbers to METRICS_DIR so other workers can report them"""
+    global _last_snapshot
+    _last_snapshot = time.monotonic()
+    path = os.path.join(METRICS_DIR, f"metrics_{os.getpid()}.json")
+    with open(path + ".tmp", "w") as file:
+        json.dump(collect(), file)
+    os.replace(path + ".tmp", path)
+
+
+def process_alive(pid):
+    """whether a process with this id is still running"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge(snapshots):
+    """adds together snapshots from several processes. Counters from workers that have exited are kept,
+    but their gauges (in flight requests, pool usage) are left out as they're no longer true."""
+    merged = {"endpoints": {}, "in_flight": 0, "pool": {}, "caches": {}}
+    for snapshot in snapshots:
+        _add_endpoints(merged["endpoints"], snapshot["endpoints"])
+
+        for name, (hits, misses) in snapshot["caches"].items():
+            total = merged["caches"].setdefault(name, [0, 0])
+            total[0] += hits
+            total[1] += misses
+
+        if snapshot["pid"] == os.getpid() or process_alive(snapshot["pid"]):
+            merged["in_flight"] += snapshot["in_flight"]
+            for key, value in snapshot["pool"].items():
+                merged["pool"][key] = merged["pool"].get(key, 0) + value
+    return merged
+
+
+def render(snapshot):
+    """formats a snapshot in the Prometheus text exposition format"""
+    lines = [
+        "# HELP myserve_requests_total Requests handled, by endpoint and status code.",
+        "# TYPE myserve_requests_total counter",
+    ]
+    for endpoint, stats in sorted(snapshot["endpoints"].items()):
+        for status, count in sorted(stats["status"].items()):
+            lines.append(
+                f'myserve_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+    lines += [
+        "# HELP myserve_request_duration_seconds Time taken to handle requests, by endpoint.",
+        "# TYPE myserve_request_duration_seconds histogram",
+    ]
+    for endpoint, stats in sorted(snapshot["endpoints"].items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), stats["buckets"]):
+            cumulative += count
+            lines.append(
+                f'myserve_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+        lines.append(
+            f'myserve_request_duration_seconds_sum{{endpoint="{endpoint}"}} {stats["sum"]:.6f}')
+        lines.append(
+            f'myserve_request_duration_seconds_count{{endpoint="{endpoint}"}} {cumulative}')
+
+    lines += [
+        "# HELP myserve_requests_in_flight Requests currently being handled.",
+        "# TYPE myserve_requests_in_flight gauge",
+        f"myserve_requests_in_flight {snapshot['in_flight']}",
+    ]
+
+    for key, value in sorted(snapshot["pool"].items()):
+        lines += [
+            f"# TYPE myserve_db_pool_{key} gauge",
+            f"myserve_db_pool_{key} {value}",
+        ]
+
+    lines += [
+        "# HELP myserve_cache_hits_total Lookups served from an in-process cache.",
+        "# TYPE myserve_cache_hits_total counter",
+    ]
+    lines += [f'myserve_cache_hits_total{{cache="{name}"}} {hits}'
+              for name, (hits, misses) in sorted(snapshot["caches"].items())]
+    lines += [
+        "# HELP myserve_cache_misses_total Lookups that had to go to the source.",
+        "# TYPE myserve_cache_misses_total counter",
+    ]
+    lines += [f'myserve_cache_misses_total{{cache="{name}"}} {misses}'
+              for name, (hits, misses) in sorted(snapshot["caches"].items())]
+    lines += [
+        "# HELP myserve_cache_hit_ratio Fraction of lookups served from the cache.",
+        "# TYPE myserve_cache_hit_ratio gauge",
+    ]
+    lines += [f'myserve_cache_hit_ratio{{cache="{name}"}} {hits / (hits + misses) if hits + misses else 0:.4f}'
+              for name, (hits, misses) in sorted(snapshot["caches"].items())]
+
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view():
+    if METRICS_DIR:
+        write_snapshot()
+        snapshots = []
+        for path in glob.glob(os.path.join(METRICS_DIR, "metrics_*.json")):
+            try:
+                with open(path) as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                # a worker may be halfway through replacing its file
+                continue
+        snapshot = merge(snapshots)
+    else:
+        snapshot = collect()
+
+    return Response(render(snapshot), mimetype="text/plain; version=0.0.4")
+
+
+def init_metrics(app, engine):
+    """starts recording request metrics and adds the /metrics page. This page isn't behind a login, so
+    the reverse proxy should only let the monitoring server reach it."""
+    global _engine
+    _engine = engine
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
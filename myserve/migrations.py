@@ -0,0 +1,102 @@
+from sqlalchemy import text
+
+# the migration that adds the report rollups
+REPORTS_VERSION = 4
+
+# each migration is (version, description, statements). They're applied in
+# order on startup and the highest version applied is recorded in the
+# schema_version table, so only add new migrations to the end of the list.
+# "user" and "group" are quoted as they're reserved words in most databases.
+MIGRATIONS = [
+    (1, "add indexes for the columns most pages filter on", [
+        'CREATE INDEX IF NOT EXISTS ix_log_user_id_group_id ON log (user_id, group_id)',
+        'CREATE INDEX IF NOT EXISTS ix_log_teacher_id ON log (teacher_id)',
+        'CREATE INDEX IF NOT EXISTS ix_log_group_id ON log (group_id)',
+        # the bundled database's group_members table has no primary key, so
+        # nothing else covers (user_id, group_id) there. On a database made by
+        # db.create_all() the composite primary key already does and this is a
+        # second copy, but memberships are rarely written, so it's left in
+        # rather than having migrations that depend on the database
+        'CREATE INDEX IF NOT EXISTS ix_group_members_user_id_group_id ON group_members (user_id, group_id)',
+        'CREATE INDEX IF NOT EXISTS ix_group_members_group_id ON group_members (group_id)',
+        'CREATE INDEX IF NOT EXISTS ix_user_role_total ON "user" (role, total)',
+    ]),
+    (2, "add indexes matching the sort order of the paginated listings", [
+        'CREATE INDEX IF NOT EXISTS ix_user_role_last_name ON "user" (role, last_name, first_name, user_id)',
+        # a log's id is its rowid, so this covers (user_id, id)
+        'CREATE INDEX IF NOT EXISTS ix_log_user_id ON log (user_id)',
+    ]),
+    (3, "add the table for background jobs", [
+        'CREATE TABLE IF NOT EXISTS job ('
+        '    id INTEGER NOT NULL PRIMARY KEY,'
+        '    kind VARCHAR NOT NULL,'
+        '    status VARCHAR NOT NULL,'
+        '    params TEXT,'
+        '    payload BLOB,'
+        '    result TEXT,'
+        '    error TEXT,'
+        '    progress INTEGER,'
+        '    total INTEGER,'
+        '    attempts INTEGER,'
+        '    cancel_requested BOOLEAN,'
+        '    worker_pid INTEGER,'
+        '    created_by VARCHAR REFERENCES "user" (user_id),'
+        '    created DATETIME,'
+        '    started DATETIME,'
+        '    finished DATETIME)',
+        'CREATE INDEX IF NOT EXISTS ix_job_status ON job (status)',
+    ]),
+    # these are filled in from the log once they've been made, see __init__.py
+    (REPORTS_VERSION, "add the weekly report rollup tables", [
+        'CREATE TABLE IF NOT EXISTS report_user_week ('
+        '    user_id VARCHAR NOT NULL,'
+        '    week DATE NOT NULL,'
+        '    hours NUMERIC NOT NULL,'
+        '    items INTEGER NOT NULL,'
+        '    PRIMARY KEY (user_id, week))',
+        'CREATE TABLE IF NOT EXISTS report_group_week ('
+        '    group_id INTEGER NOT NULL,'
+        '    week DATE NOT NULL,'
+        '    hours NUMERIC NOT NULL,'
+        '    items INTEGER NOT NULL,'
+        '    PRIMARY KEY (group_id, week))',
+        'CREATE TABLE IF NOT EXISTS report_form_week ('
+        '    form_class VARCHAR NOT NULL,'
+        '    week DATE NOT NULL,'
+        '    hours NUMERIC NOT NULL,'
+        '    items INTEGER NOT NULL,'
+        '    PRIMARY KEY (form_class, week))',
+        'CREATE TABLE IF NOT EXISTS report_teacher_week ('
+        '    teacher_id VARCHAR NOT NULL,'
+        '    week DATE NOT NULL,'
+        '    hours NUMERIC NOT NULL,'
+        '    items INTEGER NOT NULL,'
+        '    PRIMARY KEY (teacher_id, week))',
+    ]),
+]
+
+
+def get_version(connection):
+    """returns the version of the newest migration that has been applied to the database"""
+    connection.execute(
+        text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    return connection.execute(
+        text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def upgrade(engine, target=None):
+    """applies any migrations the database hasn't had yet, returning a list of the versions applied.
+    Everything happens in one transaction so a failed migration leaves the database as it was."""
+    applied = []
+    with engine.begin() as connection:
+        current = get_version(connection)
+        for version, description, statements in MIGRATIONS:
+            if version <= current or (target is not None and version > target):
+                continue
+            for statement in statements:
+                connection.execute(text(statement))
+            connection.execute(
+                text("INSERT INTO schema_version (version) VALUES (:version)"),
+                {"version": version})
+            applied.append(version)
+    return applied
@@ -1,9 +1,17 @@
 from flask_login import UserMixin, user_logged_in
 from functools import wraps
 from myserve import db
-from datetime import datetime
-from sqlalchemy import desc
+from bisect import bisect_right
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import delete, desc, event, func, insert, inspect, or_, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.orm import Session, contains_eager, joinedload, make_transient_to_detached
+from myserve.cache import CachedValue, LRUCache
+from myserve.pagination import paginate
+import json
+import os
 
 # set user roles and email as global variables so that they're easily editable
 USER_ROLE = {"student": 1,
@@ -13,9 +21,27 @@ USER_ROLE = {"student": 1,
 
 EMAIL_END = "burnside.school.nz"
 
+# how long (in seconds) a process can keep using its copy of the award table
+# before checking the database again
+AWARD_CACHE_TTL = int(os.environ.get("AWARD_CACHE_TTL", 300))
+
+# how long (in seconds) the logged in user's details are kept between requests,
+# and how many users' details are kept at once
+IDENTITY_CACHE_TTL = int(os.environ.get("IDENTITY_CACHE_TTL", 60))
+IDENTITY_CACHE_SIZE = int(os.environ.get("IDENTITY_CACHE_SIZE", 1024))
+
+# how long (in seconds) a process can keep its lists of teachers and groups for
+# forms before checking the database again
+CHOICES_CACHE_TTL = int(os.environ.get("CHOICES_CACHE_TTL", 300))
+
 
 class GroupMembers(db.Model):
     __tablename__ = "group_members"
+    # keep these in step with the indexes created in migrations.py
+    __table_args__ = (
+        db.Index("ix_group_members_user_id_group_id", "user_id", "group_id"),
+        db.Index("ix_group_members_group_id", "group_id"),
+    )
     user_id = db.Column(
         'user_id',
         db.String,
@@ -36,9 +62,24 @@ class GroupMembers(db.Model):
         """loads a GroupMembers object from the two ids that make it up"""
         return cls.query.filter_by(user_id=user_id, group_id=group_id).first()
 
+    @classmethod
+    def adjust_hours(cls, user_id, group_id, difference):
+        """adds (or subtracts) hours from a user's total for a group. This is done with an UPDATE in the
+        database so two requests at once can't overwrite each other's changes. It's not committed."""
+        cls.query.filter_by(user_id=user_id, group_id=group_id).update(
+            {cls.group_hours: cls.group_hours + difference},
+            synchronize_session=False)
+        # the leaderboards pick this up once it's committed
+        db.session.info.setdefault("group_hours_changed", []).append((user_id, group_id, difference))
+
 
 class User(UserMixin, db.Model):
     __tablename__ = 'user'
+    # used by the student list and leaderboard, see migrations.py
+    __table_args__ = (
+        db.Index("ix_user_role_total", "role", "total"),
+        db.Index("ix_user_role_last_name", "role", "last_name", "first_name", "user_id"),
+    )
     id = db.Column("user_id", db.String(), primary_key=True)
     first_name = db.Column(db.String())
     last_name = db.Column(db.String())
@@ -67,9 +108,62 @@ class User(UserMixin, db.Model):
         return cls.query.filter_by(email=email).first()
 
     @classmethod
-    def get_all(cls):
-        """gets all users in the database"""
-        return cls.query.all()
+    def load_cached(cls, user_id):
+        """loads the logged in user for a request. Their details are kept in the identity cache between
+        requests and merged into this request's session without a query, so they work just like a freshly
+        loaded user. Their total isn't cached as it changes so often - it's loaded if a page uses it."""
+        user_id = str(user_id)
+        snapshot = identity_cache.get(user_id)
+        if snapshot is not None:
+            return db.session.merge(snapshot, load=False)
+
+        user = cls.query.get(user_id)
+        if user is not None:
+            identity_cache.set(user_id, user.snapshot())
+        return user
+
+    def snapshot(self):
+        """returns a copy of the user that isn't tied to a database session, without their total"""
+        details = {attr.key: getattr(self, attr.key)
+                   for attr in inspect(User).column_attrs if attr.key != "total"}
+        copy = User(**details)
+        make_transient_to_detached(copy)
+        return copy
+
+    def get_role_name(self):
+        """returns the name of the user's role (which is also the name of the part of the site they use)
+        without needing a query"""
+        return role_cache.get().get(self.role_id)
+
+    @classmethod
+    def get_all(cls, search=None, role=None, cursor=None, page_size=None):
+        """gets a Page of the users in the database sorted by name, optionally only those matching a search
+        or with a particular role"""
+        query = cls.query
+        if search:
+            query = query.filter(cls.search_filter(search))
+        if role:
+            query = query.filter(cls.role_id == role)
+        return cls.paginate_by_name(query, cursor, page_size)
+
+    @staticmethod
+    def search_filter(search):
+        """returns a filter matching users whose id or name contains the search text"""
+        search = search.strip().lower()
+        full_name = User.first_name + " " + User.last_name
+        return or_(
+            func.lower(User.id).contains(search, autoescape=True),
+            func.lower(full_name).contains(search, autoescape=True))
+
+    @staticmethod
+    def paginate_by_name(query, cursor=None, page_size=None, user=lambda row: row):
+        """returns a Page of a query sorted by last name, first name and id. user takes a row and returns
+        the User in it, for queries that return something else"""
+        keys = (User.last_name, User.first_name, User.id)
+        return paginate(
+            query, keys,
+            lambda row: (user(row).last_name, user(row).first_name, user(row).id),
+            cursor, page_size)
 
     @classmethod
     def load_by_id(cls, id):
@@ -77,53 +171,73 @@ class User(UserMixin, db.Model):
         return cls.query.filter_by(id=id).first()
 
     @staticmethod
-    def enroll_new_user(user_id, first_name, last_name, form_class, role):
-        """Created a user object, suitable for adding to the database.
-        If the info supplied is incorrect, a list of the reasons why is returned instead. """
+    def check_new_user(user_id, first_name, last_name, form_class, role, id_taken=False):
+        """checks the info supplied for a new user, returning a dictionary of their details (suitable for
+        inserting into the database) and a list of anything wrong with them. Whether the ID is already in
+        use has to be looked up by the caller and passed in as id_taken."""
         errors = []
-        new_user = User(photo="/static/img/profile-photo-placeholder.jpg")
+        new_user = {"photo": "/static/img/profile-photo-placeholder.jpg"}
 
         # check that the user's id is unique
-        if user_id and not User.load_by_id(user_id):
-            new_user.id = user_id
-            new_user.email = f"{str(user_id).lower()}@{EMAIL_END}"
+        if user_id and not id_taken:
+            new_user["id"] = user_id
+            new_user["email"] = f"{str(user_id).lower()}@{EMAIL_END}"
         else:
             errors.append(
                 f'The User ID "{user_id}" is invalid or already in the database.')
 
         # check that they've put in a valid role
         if role in USER_ROLE.keys():
-            new_user.role_id = USER_ROLE[role]
-            if new_user.role_id == USER_ROLE["student"]:
-                new_user.total = 0
+            new_user["role_id"] = USER_ROLE[role]
+            if new_user["role_id"] == USER_ROLE["student"]:
+                new_user["total"] = 0
         else:
             errors.append(
                 f"{role} is not a valid role for users - it must be 'student', 'staff' or 'admin'.")
 
         # if their role is student, check that they've put in a form classs
-        if new_user.role_id == USER_ROLE["student"]:
+        if new_user.get("role_id") == USER_ROLE["student"]:
             if form_class:
-                new_user.form_class = form_class
+                new_user["form_class"] = form_class
             else:
                 errors.append(
                     f"{role} is not a valid role for users - it must be 'student', 'staff' or 'admin'.")
 
         # check that we've been given both names
         if first_name and last_name:
-            new_user.first_name = first_name
-            new_user.last_name = last_name
+            new_user["first_name"] = first_name
+            new_user["last_name"] = last_name
         else:
             errors.append(
                 f"Please ensure that both first and last names are provided for this user.")
 
+        return new_user, errors
+
+    @staticmethod
+    def enroll_new_user(user_id, first_name, last_name, form_class, role):
+        """Created a user object, suitable for adding to the database.
+        If the info supplied is incorrect, a list of the reasons why is returned instead. """
+        id_taken = bool(user_id) and User.load_by_id(user_id) is not None
+        details, errors = User.check_new_user(
+            user_id, first_name, last_name, form_class, role, id_taken=id_taken)
+
         # if there are any errors we don't want to add the object, otherwise
         # it's good to return
         if errors:
             return errors
         else:
+            new_user = User(**details)
             db.session.add(new_user)
             return new_user
 
+    @staticmethod
+    def get_existing_ids(user_ids):
+        """takes a list of user ids and returns the set of them that are already in the database"""
+        if not user_ids:
+            return set()
+        return {str(user_id) for user_id, in db.session.query(
+            User.id).filter(User.id.in_(user_ids))}
+
     @classmethod
     def get_teachers(cls):
         """Returns a list of all teachers in the database."""
@@ -133,19 +247,32 @@ class User(UserMixin, db.Model):
             cls.last_name)
 
     @classmethod
-    def get_students(cls):
-        """Returns a list of all students in the database."""
-        return cls.query.filter(
-            cls.role_id == USER_ROLE["student"]).order_by(
-            cls.last_name)
+    def get_students(cls, search=None, form_class=None, cursor=None, page_size=None):
+        """Returns a Page of the students in the database, optionally only those matching a search or in a
+        form class."""
+        query = cls.query.filter(cls.role_id == USER_ROLE["student"])
+        if search:
+            query = query.filter(cls.search_filter(search))
+        if form_class:
+            query = query.filter(cls.form_class == form_class)
+        return cls.paginate_by_name(query, cursor, page_size)
 
     @classmethod
-    def get_top_students(cls):
-        """Returns a list of the top 5 students in the database."""
-        return cls.query.filter(
-            cls.role_id == USER_ROLE["student"]).order_by(
-            desc(
-                cls.total)).limit(5).all()
+    def get_form_classes(cls):
+        """returns a sorted list of the form classes students are in, for filtering lists of students"""
+        rows = db.session.query(cls.form_class).filter(
+            cls.role_id == USER_ROLE["student"], cls.form_class.isnot(None)).distinct().order_by(
+            cls.form_class)
+        return [form_class for form_class, in rows]
+
+    @classmethod
+    def adjust_total(cls, user_id, difference):
+        """adds (or subtracts) hours from a user's total. This is done with an UPDATE in the database so
+        two requests at once can't overwrite each other's changes. It's not committed."""
+        cls.query.filter(cls.id == user_id).update(
+            {cls.total: cls.total + difference},
+            synchronize_session=False)
+        db.session.info.setdefault("totals_changed", []).append((user_id, difference))
 
     def update(self, first_name, last_name, picture):
         """Updates a user's record in the database with account information retrieved from Google"""
@@ -166,37 +293,48 @@ class User(UserMixin, db.Model):
         return f"{self.first_name} {self.last_name}"
 
     def get_group_options(self):
-        """returns a list of the groups a user is in as (id, name) tuples for use in forms"""
-        return [(group_assoc.group.id, group_assoc.group.name)
+        """returns a list of the groups a user is in as (id, name) tuples for use in forms. The names come
+        from the cached group list, so the groups themselves don't need loading."""
+        names = dict(group_options_cache.get())
+        return [(group_assoc.group_id, names.get(group_assoc.group_id) or group_assoc.group.name)
                 for group_assoc in self.groups]
 
+    @staticmethod
+    def load_teacher_options():
+        """loads every teacher in the school as (id, name) tuples, sorted by the database"""
+        rows = db.session.query(User.id, User.first_name, User.last_name).filter(
+            User.role_id.in_((USER_ROLE["staff"], USER_ROLE["admin"]))).order_by(
+            User.last_name, User.first_name, User.id)
+        return tuple((user_id, f"{first_name} {last_name}") for user_id, first_name, last_name in rows)
+
     @classmethod
     def get_teacher_options(cls):
-        """returns a list of all teachers in the school as (id, name) tuples for use in forms"""
-        return [(teacher.id, f"{teacher.first_name} {teacher.last_name}")
-                for teacher in cls.get_teachers()]
+        """returns a list of all teachers in the school as (id, name) tuples for use in forms, from the
+        cache if it's warm"""
+        return list(teacher_options_cache.get())
 
     def get_disabled_groups(self):
         """returns a list of the ids of groups which a user has logged hours under. We don't want them to be
-        able to be removed from the group if they've logged hours under it"""
-        group_ids = set()
-
+        able to be removed from the group if they've logged hours under it. For staff it's the groups
+        they're the only teacher in. Either way it's one query."""
         if self.role_id == USER_ROLE["student"]:
-            for item in self.hours:
-                # filter out hours which weren't put in under a group. If
-                # they're added we get problems.
-                if item.group_id:
-                    group_ids.add(item.group_id)
+            # hours which weren't put in under a group don't stop them leaving anything
+            rows = db.session.query(Log.group_id).filter(
+                Log.user_id == self.id,
+                Log.group_id.isnot(None)).distinct()
         else:
-            for group in self.groups_proxy:
-                # check if they are the only teacher in the group
-                if len(group.get_teachers()) <= 1:
-                    group_ids.add(group.id)
-        return list(group_ids)
+            user_groups = db.session.query(GroupMembers.group_id).filter(
+                GroupMembers.user_id == self.id)
+            rows = db.session.query(GroupMembers.group_id).join(
+                GroupMembers.user).filter(
+                GroupMembers.group_id.in_(user_groups),
+                User.role_id.in_((USER_ROLE["staff"], USER_ROLE["admin"]))).group_by(
+                GroupMembers.group_id).having(func.count() <= 1)
+        return [group_id for group_id, in rows]
 
     def join_groups(self, groups_join):
         """takes a list of group ids and a user and adds a new GroupMember object to the database for each one,
-         adding them to those groups"""
+         adding them to those groups. They're all added with one INSERT."""
         # setup total placeholder - if its students then we want to start at 0
         # hours, if staff we don't want any placeholder
         if self.role_id == USER_ROLE["student"]:
@@ -204,71 +342,94 @@ class User(UserMixin, db.Model):
         else:
             placeholder = None
 
-        # add them to each of the groups passed
-        for group_id in groups_join:
-            group = GroupMembers(
-                group_id=int(group_id),
-                user_id=self.id,
-                group_hours=placeholder)
-            db.session.add(group)
+        group_ids = {int(group_id) for group_id in groups_join}
+        if not group_ids:
+            return
+        db.session.bulk_insert_mappings(GroupMembers, [
+            {"group_id": group_id, "user_id": self.id, "group_hours": placeholder}
+            for group_id in sorted(group_ids)])
+        mark_rankings_stale()
         db.session.commit()
 
     def leave_groups(self, groups_leave):
         """takes a list of group ids and a user and removes their GroupMember object to the
-        database for each one, removing them from those groups"""
-        for group_id in groups_leave:
-            group = GroupMembers.load(group_id=int(group_id), user_id=self.id)
-            db.session.delete(group)
+        database for each one, removing them from those groups with one DELETE"""
+        group_ids = [int(group_id) for group_id in groups_leave]
+        if not group_ids:
+            return
+        # 'evaluate' marks any of these memberships loaded in the session as
+        # deleted without another query
+        GroupMembers.query.filter(
+            GroupMembers.user_id == self.id,
+            GroupMembers.group_id.in_(group_ids)).delete(synchronize_session="evaluate")
+        mark_rankings_stale()
         db.session.commit()
 
     def get_current_award(self):
         """takes the current amount of hours and returns an award object with the current award earned by the user."""
-        awards = Award.get_awards()
-
-        current_award = None
-
-        # compares the users total with each award, giving us the max award
-        # they've gotten
-        for i in range(len(awards)):
-            if self.total >= awards[i].threshold:
-                current_award = awards[i]
-
-        return current_award
+        return Award.find_award(Award.get_award_table(), self.total)
 
     def get_next_award(self):
-        awards = Award.get_awards()
-        current_award = self.get_current_award()
-
-        if current_award is not None:
-            index = awards.index(current_award)
-
-            # check if there is actually another award for them to get or if
-            # they've maxed out
-            if index < len(awards) - 1:
-                next_award = awards[index + 1]
-            else:
-                next_award = None
-        else:
-            # they've got no award, so it must be the first one
-            next_award = awards[0]
-
-        return next_award
-
-    def get_hours_responsible(self):
-        """retrieves the hours which a teacher has been indicated by students as being responsible for"""
-        return Log.query.filter(Log.teacher_id == self.id).all()
+        """returns the next award the user is working towards, or None if they've got the highest one"""
+        awards, thresholds = Award.get_award_table()
+        index = bisect_right(thresholds, self.total or 0)
+        return awards[index] if index < len(awards) else None
+
+    def get_log(self, date_from=None, date_to=None, cursor=None, page_size=None):
+        """returns a Page of a user's logged hours, optionally only those done between two dates. Their
+        groups are loaded in the same query, so pages listing the log don't need a query for each item's
+        group"""
+        query = Log.filter_dates(Log.query.options(
+            joinedload(Log.group)).filter(
+            Log.user_id == self.id), date_from, date_to)
+        return Log.paginate_by_id(query, cursor, page_size)
+
+    def get_hours_responsible(self, search=None, date_from=None, date_to=None, cursor=None, page_size=None):
+        """retrieves a Page of the hours which a teacher has been indicated by students as being responsible
+        for, with the students who logged them loaded in the same query. They can be filtered by the
+        student's name and the date the work was done."""
+        query = Log.query.options(
+            joinedload(Log.user)).filter(
+            Log.teacher_id == self.id)
+        if search:
+            query = query.filter(Log.user.has(User.search_filter(search)))
+        query = Log.filter_dates(query, date_from, date_to)
+        return Log.paginate_by_id(query, cursor, page_size)
 
     def remove(self):
         """removes a user and all data associated with them from the database"""
-        for hour in self.hours:
-            hour.delete()
+        User.remove_users([self.id])
+        return
 
-        for group in self.groups_proxy:
-            group.remove_user(self)
+    @staticmethod
+    def remove_users(user_ids, chunk_size=500, progress=None):
+        """removes many users and all data associated with them in one transaction, using a few DELETE
+        statements per chunk of users rather than deleting rows one at a time. Returns how many users were
+        removed. Nobody else's totals change, as the removed users' hours only counted towards their own.
+        progress is called with the number of ids processed after each chunk."""
+        user_ids = list(user_ids)
+        removed = 0
+        for user_id in user_ids:
+            forget_user(user_id)
+        forget_options()
+        mark_rankings_stale()
+
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            Log.adjust_reports(removed=Log.report_rows(Log.user_id.in_(chunk)))
+            Log.query.filter(Log.user_id.in_(chunk)).delete(
+                synchronize_session=False)
+            GroupMembers.query.filter(GroupMembers.user_id.in_(chunk)).delete(
+                synchronize_session=False)
+            # 'fetch' marks any of these users loaded in the session as deleted,
+            # so the session doesn't try to refresh them after the commit
+            removed += User.query.filter(User.id.in_(chunk)).delete(
+                synchronize_session="fetch")
+            if progress:
+                progress(start + len(chunk))
 
-        db.session.delete(self)
         db.session.commit()
-        return
+        return removed
 
 
 class Group(db.Model):
@@ -302,13 +463,17 @@ class Group(db.Model):
         """Loads all groups in the database"""
         return cls.query.all()
 
+    @staticmethod
+    def load_group_options():
+        """loads every group as (id, name) tuples, sorted by name in the database"""
+        rows = db.session.query(Group.id, Group.name).order_by(Group.name, Group.id)
+        return tuple((group_id, name) for group_id, name in rows)
+
     @classmethod
     def get_group_options(cls):
-        """returns a sorted list of the groups in the database (id, name) tuples for use in forms"""
-        groups = [(group.id, group.name) for group in cls.get_all()]
-        # sort the values alphabetically by their name
-        groups.sort(key=lambda x: x[1])
-        return groups
+        """returns a sorted list of the groups in the database (id, name) tuples for use in forms, from the
+        cache if it's warm"""
+        return list(group_options_cache.get())
 
     def get_teachers(self):
         """uses the group ID to return a list of user objects of the teachers in a particualr group"""
@@ -318,17 +483,66 @@ class Group(db.Model):
                 (USER_ROLE["staff"], USER_ROLE["admin"]))).all()
         return teachers
 
-    def get_students(self):
-        """uses the group ID to return a list of GroupMember objects of the students in a particualr group"""
-        teachers = GroupMembers.query.join(
-            GroupMembers.user).filter(
+    def get_students(self, search=None, cursor=None, page_size=None):
+        """uses the group ID to return a Page of GroupMember objects of the students in a particualr group,
+        sorted by name and optionally only those matching a search"""
+        # the users are already joined to filter on their role, so we fill
+        # in GroupMembers.user from the same query
+        query = GroupMembers.query.join(
+            GroupMembers.user).options(
+            contains_eager(GroupMembers.user)).filter(
             GroupMembers.group_id == self.id,
-            User.role_id == USER_ROLE["student"]).all()
-        return teachers
+            User.role_id == USER_ROLE["student"])
+        if search:
+            query = query.filter(User.search_filter(search))
+        return User.paginate_by_name(query, cursor, page_size, user=lambda member: member.user)
 
     def get_no_students(self):
         """returns the number of students in a given group"""
-        return len(self.get_students())
+        return db.session.query(
+            func.count()).select_from(GroupMembers).join(
+            GroupMembers.user).filter(
+            GroupMembers.group_id == self.id,
+            User.role_id == USER_ROLE["student"]).scalar()
+
+    @staticmethod
+    def count_students(group_ids):
+        """takes a list of group ids and returns a dictionary of how many students are in each group,
+        counted in one query rather than one per group"""
+        group_ids = list(group_ids)
+        counts = dict.fromkeys(group_ids, 0)
+        if not group_ids:
+            return counts
+
+        rows = db.session.query(
+            GroupMembers.group_id, func.count()).join(
+            GroupMembers.user).filter(
+            GroupMembers.group_id.in_(group_ids),
+            User.role_id == USER_ROLE["student"]).group_by(
+            GroupMembers.group_id)
+        counts.update(rows)
+        return counts
+
+    @staticmethod
+    def get_largest_groups(user, limit=5):
+        """returns the groups a user is in with the most students as (group, no. students) tuples,
+        biggest first. The counting, sorting and limiting is all done by the database."""
+        user_groups = db.session.query(GroupMembers.group_id).filter(
+            GroupMembers.user_id == user.id)
+
+        student_counts = db.session.query(
+            GroupMembers.group_id.label("group_id"),
+            func.count().label("students")).join(
+            GroupMembers.user).filter(
+            GroupMembers.group_id.in_(user_groups),
+            User.role_id == USER_ROLE["student"]).group_by(
+            GroupMembers.group_id).subquery()
+
+        no_students = func.coalesce(student_counts.c.students, 0)
+        return db.session.query(Group, no_students).filter(
+            Group.id.in_(user_groups)).outerjoin(
+            student_counts, student_counts.c.group_id == Group.id).order_by(
+            desc(no_students), Group.name).limit(limit).all()
 
     def get_teachers_string(self):
         """gives the teachers of a group in a format suitable for display"""
@@ -345,18 +559,48 @@ class Group(db.Model):
             Log.group_id == self.id).all()
         return logged_items
 
+    def delete_hours(self, *criterion):
+        """deletes the hours logged under this group (optionally only those matching a filter), taking them
+        off the students' totals. It's done with a few set-based statements and isn't committed. Returns how
+        many students were affected and how many log entries were deleted."""
+        group_log = Log.query.filter(Log.group_id == self.id, *criterion)
+
+        # take each student's hours in the group off their total in one go
+        hours_in_group = db.session.query(
+            func.coalesce(func.sum(Log.time), 0)).filter(
+            Log.user_id == User.id, Log.group_id == self.id, *criterion).scalar_subquery()
+        students = User.query.filter(
+            User.id.in_(group_log.with_entities(Log.user_id))).update(
+            {User.total: User.total - hours_in_group},
+            synchronize_session=False)
+
+        Log.adjust_reports(removed=Log.report_rows(Log.group_id == self.id, *criterion))
+        hours = group_log.delete(synchronize_session=False)
+        return students, hours
+
     def delete(self):
-        """deletes a group"""
+        """deletes a group along with its members and all the hours logged under it, taking those hours off
+        the students' totals. It's all done with a few set-based statements in one transaction, and the
+        number of students, log entries and memberships affected is returned as a dictionary."""
+        students, hours = self.delete_hours()
+        members = GroupMembers.query.filter(
+            GroupMembers.group_id == self.id).delete(synchronize_session=False)
+
         db.session.delete(self)
+        mark_rankings_stale()
         db.session.commit()
-        return
+        return {"students": students, "hours": hours, "members": members}
 
     def remove_user(self, user):
-        """deletes all of a user's hours from a group (if student), then removes them."""
+        """deletes all of a user's hours from a group (if student) and removes them from it, in one
+        transaction"""
         if user.role_id == USER_ROLE['student']:
-            for item in self.get_user_log(user):
-                item.delete()
-        user.leave_groups([self.id])
+            self.delete_hours(Log.user_id == user.id)
+        GroupMembers.query.filter(
+            GroupMembers.user_id == user.id,
+            GroupMembers.group_id == self.id).delete(synchronize_session="evaluate")
+        mark_rankings_stale()
+        db.session.commit()
         return
 
 
@@ -369,6 +613,13 @@ class UserRole(db.Model):
 
 class Log(db.Model):
     __tablename__ = "log"
+    # keep these in step with the indexes created in migrations.py
+    __table_args__ = (
+        db.Index("ix_log_user_id_group_id", "user_id", "group_id"),
+        db.Index("ix_log_user_id", "user_id"),
+        db.Index("ix_log_teacher_id", "teacher_id"),
+        db.Index("ix_log_group_id", "group_id"),
+    )
     id = db.Column(db.Integer(), primary_key=True)
     user_id = db.Column(db.String(), db.ForeignKey('user.user_id'))
     group_id = db.Column(db.Integer(), db.ForeignKey('group.id'))
@@ -397,9 +648,31 @@ class Log(db.Model):
         """loads a previous log from the database using its ID"""
         return cls.query.filter_by(id=id).first()
 
+    @staticmethod
+    def filter_dates(query, date_from=None, date_to=None):
+        """filters a query of logged hours to the work done between two dates (inclusive)"""
+        if date_from:
+            query = query.filter(Log.date >= date_from)
+        if date_to:
+            query = query.filter(Log.date <= date_to)
+        return query
+
+    @staticmethod
+    def get_state(*criterion):
+        """returns a version of the logged hours matching a filter, which changes whenever any of them
+        are added, edited or deleted. Used to tell if a page has changed."""
+        newest, count, hours = db.session.query(
+            func.max(Log.log_time), func.count(Log.id), func.sum(Log.time)).filter(*criterion).one()
+        return newest, count, str(hours)
+
+    @staticmethod
+    def paginate_by_id(query, cursor=None, page_size=None):
+        """returns a Page of a query of logged hours in the order they were logged"""
+        return paginate(query, (Log.id,), lambda item: (item.id,), cursor, page_size)
+
     @classmethod
     def add_hours(cls, user, group_id, teacher_id, time, description, date):
-        """creates a new log object in the database to record the hours of users"""
+        """creates a new log object in the database to record the hours of users, returning it"""
         new_hours = cls(
             user_id=user.id,
             group_id=group_id,
@@ -411,21 +684,21 @@ class Log(db.Model):
         )
         db.session.add(new_hours)
 
-        # we need to update the user's total
-        user.total += new_hours.time
-
-        # if the hours were done in a group, then we need to udpate the group
-        # total
-        if group_id != "None":
-            group_member = GroupMembers.load(
-                user_id=user.id, group_id=group_id)
-            group_member.group_hours += new_hours.time
-        else:
+        # if the hours weren't done in a group, then we record the teacher
+        # responsible instead
+        if group_id == "None":
             new_hours.teacher_id = teacher_id
             new_hours.group_id = None
 
+        # we need to update the user's total, and the group total if the hours
+        # were done in a group
+        User.adjust_total(user.id, new_hours.time)
+        if new_hours.group_id is not None:
+            GroupMembers.adjust_hours(user.id, group_id, new_hours.time)
+        cls.adjust_reports(added=[new_hours.report_row(user.form_class)])
+
         db.session.commit()
-        return
+        return new_hours
 
     def edit_hours(
             self,
@@ -437,8 +710,10 @@ class Log(db.Model):
             status=1):
         """edits hours previously logged by a user"""
         old_time = self.time
-        old_group = self.group
+        old_group_id = self.group_id
         difference = time - old_time
+        form_class = self.user.form_class
+        old_row = self.report_row(form_class)
 
         self.group_id = group_id
         self.time = time
@@ -449,13 +724,12 @@ class Log(db.Model):
         self.teacher_id = None
 
         # add (or subtract!) any difference in hours from their total
-        self.user.total += difference
+        User.adjust_total(self.user_id, difference)
 
         # if they recorded their hours under our group, we'll subtract them
         # from the total incase they've changed group
-        if old_group:
-            old_group_member = GroupMembers.load(self.user_id, old_group.id)
-            old_group_member.group_hours -= old_time
+        if old_group_id:
+            GroupMembers.adjust_hours(self.user_id, old_group_id, -old_time)
 
         # if there is a new group, we'll add the hours to its total. If there's
         # now a teacher, then we will record that instead
@@ -463,8 +737,9 @@ class Log(db.Model):
             self.teacher_id = teacher_id
             self.group_id = None
         else:
-            group_member = GroupMembers.load(self.user_id, group_id)
-            group_member.group_hours += self.time
+            GroupMembers.adjust_hours(self.user_id, group_id, self.time)
+
+        Log.adjust_reports(added=[self.report_row(form_class)], removed=[old_row])
 
         db.session.commit()
         return
@@ -472,17 +747,96 @@ class Log(db.Model):
     def delete(self):
         """deletes logged hours"""
         # update the user's total
-        self.user.total -= self.time
+        User.adjust_total(self.user_id, -self.time)
 
         # if the hours were in a group, then we need to change that total too
-        if self.group:
-            group_member = GroupMembers.load(self.user_id, self.group.id)
-            group_member.group_hours -= self.time
+        if self.group_id:
+            GroupMembers.adjust_hours(self.user_id, self.group_id, -self.time)
+        Log.adjust_reports(removed=[self.report_row(self.user.form_class)])
 
         db.session.delete(self)
         db.session.commit()
         return
 
+    def report_row(self, form_class):
+        """the details of this item the reports are added up by, as in report_rows"""
+        return self.user_id, form_class, self.group_id, self.teacher_id, self.date, self.log_time, self.time
+
+    @staticmethod
+    def report_rows(*criterion):
+        """a query of the details the reports are added up by for the logged hours matching a filter:
+        (user_id, form_class, group_id, teacher_id, date, log_time, time)"""
+        return db.session.query(
+            Log.user_id, User.form_class, Log.group_id, Log.teacher_id, Log.date, Log.log_time,
+            Log.time).outerjoin(
+            User, Log.user_id == User.id).filter(*criterion)
+
+    @staticmethod
+    def adjust_reports(added=(), removed=()):
+        """adds hours to (and takes them off) the weekly report rollups, from rows like report_rows'.
+        The rows are added up per week first, so an edit that stays in the same week only changes each
+        rollup row once. It's not committed, so it happens in the same transaction as the change to the
+        log."""
+        changes = defaultdict(lambda: [0, 0])
+        for sign, rows in ((1, added), (-1, removed)):
+            for user_id, form_class, group_id, teacher_id, day, log_time, time in rows:
+                week = week_of(day or log_time.date())
+                # ids can come from a form as strings, so they're made the same as the columns'
+                keys = [(UserWeek, str(user_id)), (FormWeek, form_class or "")]
+                # hours are recorded against a group, or against a teacher if they weren't done in one
+                if group_id is not None:
+                    keys.append((GroupWeek, int(group_id)))
+                if teacher_id is not None:
+                    keys.append((TeacherWeek, str(teacher_id)))
+                for model, key in keys:
+                    change = changes[model, key, week]
+                    change[0] += sign * (time or 0)
+                    change[1] += sign
+
+        for (model, key, week), (hours, items) in changes.items():
+            if hours or items:
+                model.adjust(key, week, hours, items)
+
+    @staticmethod
+    def reconcile_totals(fix=False):
+        """recomputes every student's total and group totals from the log, returning the ones that have
+        drifted as two lists: (user_id, stored, actual) and (user_id, group_id, stored, actual).
+        If fix is True the stored totals are corrected."""
+        logged = func.coalesce(func.sum(Log.time), 0)
+
+        user_rows = db.session.query(
+            User.id, User.total, logged).outerjoin(
+            Log, Log.user_id == User.id).filter(
+            User.role_id == USER_ROLE["student"]).group_by(User.id, User.total)
+        user_drift = [(user_id, stored, actual)
+                      for user_id, stored, actual in user_rows
+                      if abs((stored or 0) - actual) > 0.001]
+
+        group_rows = db.session.query(
+            GroupMembers.user_id,
+            GroupMembers.group_id,
+            GroupMembers.group_hours,
+            logged).join(
+            GroupMembers.user).outerjoin(
+            Log, (Log.user_id == GroupMembers.user_id) & (Log.group_id == GroupMembers.group_id)).filter(
+            User.role_id == USER_ROLE["student"]).group_by(
+            GroupMembers.user_id, GroupMembers.group_id, GroupMembers.group_hours)
+        group_drift = [(user_id, group_id, stored, actual)
+                       for user_id, group_id, stored, actual in group_rows
+                       if abs((stored or 0) - actual) > 0.001]
+
+        if fix:
+            for user_id, stored, actual in user_drift:
+                User.query.filter(User.id == user_id).update(
+                    {User.total: actual}, synchronize_session=False)
+            for user_id, group_id, stored, actual in group_drift:
+                GroupMembers.query.filter_by(user_id=user_id, group_id=group_id).update(
+                    {GroupMembers.group_hours: actual}, synchronize_session=False)
+            mark_rankings_stale()
+            db.session.commit()
+
+        return user_drift, group_drift
+
 
 class LogStatus(db.Model):
     __tablename__ = "log_status"
@@ -499,7 +853,304 @@ class Award(db.Model):
     colour = db.Column(db.String())
     threshold = db.Column(db.Integer())
 
+    @staticmethod
+    def load_award_table():
+        """loads the awards from the database sorted by threshold, returning them along with a list of
+        their thresholds so they can be searched with bisect"""
+        awards = tuple(
+            AwardInfo(award.id, award.name, award.colour, award.threshold)
+            for award in Award.query.order_by(Award.threshold))
+        return awards, [award.threshold for award in awards]
+
+    @staticmethod
+    def get_award_table():
+        """returns the (awards, thresholds) pair from the cache, only hitting the database if it's empty"""
+        return award_cache.get()
+
     @staticmethod
     def get_awards():
-        """gets all awards stored in the database sorted in order of size ascedning"""
-        return Award.query.order_by(Award.threshold).all()
+        """gets all awards sorted in order of size ascending"""
+        return Award.get_award_table()[0]
+
+    @staticmethod
+    def find_award(award_table, total):
+        """takes an (awards, thresholds) table from get_award_table() and an amount of hours, returning the
+        highest award the hours are enough for (or None if they haven't got one yet)"""
+        awards, thresholds = award_table
+        index = bisect_right(thresholds, total or 0) - 1
+        return awards[index] if index >= 0 else None
+
+    @staticmethod
+    def get_user_awards(users):
+        """takes a list of users and returns a dictionary of their current awards keyed by user id"""
+        award_table = Award.get_award_table()
+        return {user.id: Award.find_award(award_table, user.total) for user in users}
+
+
+class Job(db.Model):
+    """a slow admin task (e.g. importing a csv) that's run in the background by jobs.py. Its parameters
+    and results are kept here so the task survives a restart and can be retried. Uploaded csv files are
+    saved in the instance folder, with their path in the parameters."""
+    __tablename__ = "job"
+    # keep these in step with the migration that creates the table
+    __table_args__ = (db.Index("ix_job_status", "status"),)
+    id = db.Column(db.Integer(), primary_key=True)
+    kind = db.Column(db.String(), nullable=False)
+    # queued, running, done, failed or cancelled
+    status = db.Column(db.String(), nullable=False, default="queued")
+    params = db.Column(db.Text())
+    # a small file the job needs. Uploads can be big, so they're saved to disk
+    # instead of being kept here
+    payload = db.Column(db.LargeBinary())
+    result = db.Column(db.Text())
+    error = db.Column(db.Text())
+    progress = db.Column(db.Integer(), default=0)
+    total = db.Column(db.Integer())
+    attempts = db.Column(db.Integer(), default=0)
+    cancel_requested = db.Column(db.Boolean(), default=False)
+    # the process running the job, so jobs left behind by a process that died can be found
+    worker_pid = db.Column(db.Integer())
+    created_by = db.Column(db.String(), db.ForeignKey('user.user_id'))
+    created = db.Column(db.DateTime())
+    started = db.Column(db.DateTime())
+    finished = db.Column(db.DateTime())
+
+    creator = db.relationship("User")
+
+    FINISHED = ("done", "failed", "cancelled")
+
+    @classmethod
+    def load(cls, id):
+        return cls.query.filter_by(id=id).first()
+
+    @classmethod
+    def create(cls, kind, params=None, payload=None, total=None, user=None):
+        """adds a queued job to the database and commits it"""
+        job = cls(
+            kind=kind,
+            params=json.dumps(params or {}),
+            payload=payload,
+            total=total,
+            created_by=user.id if user else None,
+            created=datetime.now(),
+            status="queued",
+            progress=0,
+            attempts=0,
+            cancel_requested=False)
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    @classmethod
+    def get_recent(cls, user=None, limit=50):
+        """returns the newest jobs, only those a user started if one is given"""
+        query = cls.query.options(joinedload(cls.creator))
+        if user is not None:
+            query = query.filter(cls.created_by == user.id)
+        return query.order_by(desc(cls.id)).limit(limit).all()
+
+    def get_params(self):
+        return json.loads(self.params or "{}")
+
+    def get_result(self):
+        return json.loads(self.result) if self.result else {}
+
+    def is_finished(self):
+        return self.status in self.FINISHED
+
+    def can_view(self, user):
+        """admins can see every job, staff only the ones they started"""
+        return user.role_id == USER_ROLE["admin"] or str(self.created_by) == str(user.id)
+
+
+def week_of(day):
+    """the monday of the week a date is in, which is what the report rollups are grouped by"""
+    return day - timedelta(days=day.weekday())
+
+
+# upserts are done with INSERT ... ON CONFLICT where the database has it
+UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+class ReportRollup:
+    """the columns shared by the report tables, which each hold the hours logged per week for one kind
+    of thing (a student, group, form class or teacher). They're kept up to date by Log.adjust_reports
+    whenever hours are logged, edited or deleted, so reports only have to read a row per week rather
+    than adding up the whole log. `flask rebuild-reports` recalculates them from the log."""
+    # the column the hours are grouped by, set by each table
+    KEY = None
+
+    # the monday of the week the work was done in
+    week = db.Column(db.Date(), nullable=False)
+    hours = db.Column(db.Numeric(), nullable=False, default=0)
+    items = db.Column(db.Integer(), nullable=False, default=0)
+
+    @classmethod
+    def adjust(cls, key, week, hours, items):
+        """adds hours and items (either can be negative) to a week's row, creating it if needed and
+        removing it once nothing is left in it. It's not committed."""
+        table = cls.__table__
+        key_column = table.c[cls.KEY]
+        values = {cls.KEY: key, "week": week, "hours": hours, "items": items}
+
+        upsert = UPSERTS.get(db.session.get_bind().dialect.name)
+        if upsert is not None:
+            statement = upsert(table).values(values)
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=[cls.KEY, "week"],
+                set_={"hours": table.c.hours + statement.excluded.hours,
+                      # items is also the name of a method, so it has to be looked up
+                      "items": table.c["items"] + statement.excluded["items"]}))
+        else:
+            updated = db.session.execute(update(table).where(
+                key_column == key, table.c.week == week).values(
+                hours=table.c.hours + hours, items=table.c["items"] + items)).rowcount
+            if not updated:
+                db.session.execute(insert(table).values(values))
+
+        if items < 0:
+            db.session.execute(delete(table).where(
+                key_column == key, table.c.week == week, table.c["items"] <= 0))
+
+
+# keep these tables in step with the migration that creates them
+class UserWeek(ReportRollup, db.Model):
+    __tablename__ = "report_user_week"
+    __table_args__ = (db.PrimaryKeyConstraint("user_id", "week"),)
+    KEY = "user_id"
+    user_id = db.Column(db.String(), nullable=False)
+
+
+class GroupWeek(ReportRollup, db.Model):
+    __tablename__ = "report_group_week"
+    __table_args__ = (db.PrimaryKeyConstraint("group_id", "week"),)
+    KEY = "group_id"
+    group_id = db.Column(db.Integer(), nullable=False)
+
+
+class FormWeek(ReportRollup, db.Model):
+    """the form class a student was in when they logged the hours. Students without one are under ""."""
+    __tablename__ = "report_form_week"
+    __table_args__ = (db.PrimaryKeyConstraint("form_class", "week"),)
+    KEY = "form_class"
+    form_class = db.Column(db.String(), nullable=False)
+
+
+class TeacherWeek(ReportRollup, db.Model):
+    __tablename__ = "report_teacher_week"
+    __table_args__ = (db.PrimaryKeyConstraint("teacher_id", "week"),)
+    KEY = "teacher_id"
+    teacher_id = db.Column(db.String(), nullable=False)
+
+
+# awards are cached as plain tuples so they can be shared between requests
+# without being tied to a database session
+AwardInfo = namedtuple("AwardInfo", ["id", "name", "colour", "threshold"])
+
+award_cache = CachedValue(
+    "awards",
+    Award.load_award_table,
+    ttl=AWARD_CACHE_TTL)
+
+
+role_cache = CachedValue(
+    "roles",
+    lambda: {role.id: role.name for role in UserRole.query},
+    ttl=IDENTITY_CACHE_TTL)
+
+identity_cache = LRUCache(
+    "identity",
+    maxsize=IDENTITY_CACHE_SIZE,
+    ttl=IDENTITY_CACHE_TTL)
+
+# the teacher and group choices on the hours and group forms
+teacher_options_cache = CachedValue(
+    "teacher_options",
+    User.load_teacher_options,
+    ttl=CHOICES_CACHE_TTL)
+
+group_options_cache = CachedValue(
+    "group_options",
+    Group.load_group_options,
+    ttl=CHOICES_CACHE_TTL)
+
+
+# changing any of these through the ORM (rather than adjust_total or adjust_hours)
+# means the leaderboards need rebuilding
+RANKED_ATTRIBUTES = {
+    User: ("first_name", "last_name", "form_class", "role_id", "total"),
+    GroupMembers: ("group_hours",),
+}
+
+# changing any of these means the teacher or group choices need reloading
+CHOICE_ATTRIBUTES = {
+    User: ("first_name", "last_name", "role_id"),
+    Group: ("name",),
+}
+
+
+def forget_user(user_id, session=None):
+    """marks a user's cached details to be thrown away once the current transaction is committed"""
+    session = session or db.session
+    session.info.setdefault("users_changed", set()).add(str(user_id))
+
+
+def forget_options(session=None):
+    """marks the teacher and group choices to be reloaded once the current transaction is committed, for
+    bulk changes that don't go through the session (e.g. importing or removing users)"""
+    session = session or db.session
+    session.info["options_changed"] = True
+
+
+def mark_rankings_stale(session=None):
+    """marks the leaderboards to be rebuilt once the current transaction is committed. This is for changes
+    that add or remove students or memberships, or that change hours without going through adjust_total"""
+    session = session or db.session
+    session.info["rankings_stale"] = True
+
+
+@event.listens_for(Session, "after_flush")
+def note_changes(session, flush_context):
+    """remembers which cached data was written so the caches can be cleared once the changes are committed"""
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            forget_user(obj.id, session)
+    for obj in (*session.new, *session.deleted):
+        if isinstance(obj, (User, GroupMembers)):
+            mark_rankings_stale(session)
+    for obj in session.dirty:
+        attributes = RANKED_ATTRIBUTES.get(type(obj), ())
+        if any(inspect(obj).attrs[name].history.has_changes() for name in attributes):
+            mark_rankings_stale(session)
+        attributes = CHOICE_ATTRIBUTES.get(type(obj), ())
+        if any(inspect(obj).attrs[name].history.has_changes() for name in attributes):
+            forget_options(session)
+    for obj in (*session.new, *session.deleted):
+        if isinstance(obj, (User, Group)):
+            forget_options(session)
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Award):
+            session.info["awards_changed"] = True
+        elif isinstance(obj, UserRole):
+            session.info["roles_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def clear_caches(session):
+    if session.info.pop("awards_changed", False):
+        award_cache.invalidate()
+    if session.info.pop("roles_changed", False):
+        role_cache.invalidate()
+    for user_id in session.info.pop("users_changed", ()):
+        identity_cache.invalidate(user_id)
+    if session.info.pop("options_changed", False):
+        teacher_options_cache.invalidate()
+        group_options_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_changes(session):
+    session.info.pop("awards_changed", None)
+    session.info.pop("roles_changed", None)
+    session.info.pop("users_changed", None)
+    session.info.pop("options_changed", None)
@@ -0,0 +1,162 @@
+import json
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# how long to keep the discovery document if the response doesn't tell us
+DEFAULT_TTL = 3600
+# start refreshing this many seconds before the cached copy expires...
+REFRESH_MARGIN = 300
+# ...or this fraction of the way through its lifetime, if that's later, so a
+# short-lived copy isn't refreshed on every login
+REFRESH_FRACTION = 0.75
+# never hand out a copy older than this, even if the provider is down
+MAX_STALE = 24 * 3600
+
+
+class ProviderClient:
+    """a connection-pooled HTTP client for talking to the identity provider. Connections are kept
+    alive between logins, every request has a timeout, and failed requests are retried with backoff.
+    POSTs are only retried if the connection couldn't be made, as authorisation codes only work once."""
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10, retries=3, backoff=0.3):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, **kwargs)
+
+
+def parse_max_age(cache_control, default=DEFAULT_TTL):
+    """takes a Cache-Control header and returns how many seconds the response can be cached for"""
+    if not cache_control:
+        return default
+    directives = cache_control.lower()
+    if "no-store" in directives or "no-cache" in directives:
+        return 0
+    match = re.search(r"max-age=(\d+)", directives)
+    if match:
+        return int(match.group(1))
+    return default
+
+
+class DiscoveryCache:
+    """keeps a copy of an OpenID discovery document in memory so that logging in doesn't have to wait
+    on the identity provider. The copy is refreshed in the background before it expires, and if the
+    provider can't be reached we keep serving the old copy for up to MAX_STALE seconds. After that the
+    error is raised, rather than logging people in against a document that may no longer be true."""
+
+    def __init__(self, url, local_file=None, client=None, refresh_margin=REFRESH_MARGIN, max_stale=MAX_STALE):
+        self.url = url
+        self.client = client or ProviderClient()
+        # a local copy of the document can be used instead, e.g. when testing offline
+        self.local_file = local_file
+        self.refresh_margin = refresh_margin
+        self.max_stale = max_stale
+
+        self._document = None
+        self._fetched = 0
+        self._refresh_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def get(self):
+        """returns the discovery document, only blocking on the network if we have never fetched it
+        or our copy is too old to be trusted. Raises the error if it can't be fetched then."""
+        now = time.monotonic()
+        document = self._document
+
+        if document is None or now - self._fetched > self.max_stale:
+            self.misses += 1
+            return self._fetch()
+
+        self.hits += 1
+        # it's getting close to expiring (or already has), so get a new copy
+        # without making this request wait for it
+        if now >= self._refresh_at:
+            self._refresh_in_background()
+        return document
+
+    def stats(self):
+        """returns the counters for the cache, handy for checking logins aren't waiting on the network"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
+
+    def clear(self):
+        """forgets the cached document so the next call fetches a new one"""
+        with self._lock:
+            self._document = None
+            self._fetched = self._refresh_at = 0
+
+    def _load(self):
+        """gets the document and how long it can be kept for, from a local file if one is set"""
+        if self.local_file:
+            with open(self.local_file) as file:
+                return json.load(file), self.max_stale
+
+        response = self.client.get(self.url)
+        response.raise_for_status()
+        return response.json(), parse_max_age(response.headers.get("Cache-Control"))
+
+    def _fetch(self):
+        """fetches the document, storing it in the cache"""
+        try:
+            document, ttl = self._load()
+        except (requests.RequestException, OSError, ValueError):
+            self.failures += 1
+            raise
+
+        now = time.monotonic()
+        with self._lock:
+            self._document = document
+            self._fetched = now
+            self._refresh_at = now + max(ttl - self.refresh_margin, ttl * REFRESH_FRACTION)
+        return document
+
+    def _refresh_in_background(self):
+        """starts a thread to refresh the document, unless one is already running"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.refreshes += 1
+                self._fetch()
+            except (requests.RequestException, OSError, ValueError):
+                # the copy we have keeps being used until it's too old, see get()
+                pass
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
@@ -0,0 +1,115 @@
+import base64
+import json
+import os
+from datetime import datetime
+from flask import request, url_for
+from sqlalchemy import and_, or_
+
+# how many rows a listing shows by default, and the most a page can ask for
+PAGE_SIZE = int(os.environ.get("PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 200))
+
+
+class Page:
+    """one page of a listing, along with the cursors for the pages either side of it (None if there
+    isn't one). Iterating over it gives the items on the page."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def get_page_size(value=None):
+    """turns a requested page size into one between 1 and MAX_PAGE_SIZE, using PAGE_SIZE if none (or
+    rubbish) was asked for"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+    return min(max(size, 1), MAX_PAGE_SIZE)
+
+
+def encode_cursor(direction, values):
+    """packs a direction ("next" or "prev") and the sort keys of a row into a string for a url"""
+    data = json.dumps([direction, values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """unpacks a cursor made by encode_cursor, returning (None, None) if it's missing or has been
+    mangled, so a bad link just goes back to the first page"""
+    if not cursor:
+        return None, None
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, values = json.loads(data)
+    except (ValueError, TypeError):
+        return None, None
+    if direction not in ("next", "prev") or not isinstance(values, list):
+        return None, None
+    return direction, values
+
+
+def seek(keys, values, forwards=True):
+    """builds the filter for the rows after (or before) a row with the given sort keys. (a, b) > (x, y)
+    is written out as a > x OR (a = x AND b > y), which works on every database and can use an index."""
+    clauses = []
+    for i, key in enumerate(keys):
+        compare = key > values[i] if forwards else key < values[i]
+        clauses.append(and_(*[keys[j] == values[j] for j in range(i)], compare))
+    return or_(*clauses)
+
+
+def paginate(query, keys, row_key, cursor=None, page_size=None):
+    """returns a Page of a query using keyset pagination. Rather than an OFFSET, which makes the database
+    count through every row before the page, each page carries on from the sort keys of the last row of
+    the page before, so every page takes the same time however far in it is.
+
+    keys are the columns to sort by (the last must be unique so the order is stable) and row_key takes a
+    row and returns the values of those columns for it."""
+    page_size = get_page_size(page_size)
+    direction, values = decode_cursor(cursor)
+    if values is not None and len(values) != len(keys):
+        direction = values = None
+
+    forwards = direction != "prev"
+    if values is not None:
+        query = query.filter(seek(keys, values, forwards))
+    order = keys if forwards else [key.desc() for key in keys]
+
+    # get one extra row to find out if there's another page after this one
+    items = query.order_by(None).order_by(*order).limit(page_size + 1).all()
+    more = len(items) > page_size
+    items = items[:page_size]
+    if not forwards:
+        items.reverse()
+    if not items:
+        return Page(items)
+
+    first = encode_cursor("prev", list(row_key(items[0])))
+    last = encode_cursor("next", list(row_key(items[-1])))
+    if forwards:
+        return Page(items, last if more else None, first if values is not None else None)
+    return Page(items, last, first if more else None)
+
+
+def page_url(cursor):
+    """returns the url of the current page with a different cursor, keeping any search filters"""
+    args = request.args.to_dict()
+    args["cursor"] = cursor
+    return url_for(request.endpoint, **request.view_args, **args)
+
+
+def date_arg(name):
+    """reads a YYYY-MM-DD date from the query string, returning None if it's missing or invalid"""
+    try:
+        return datetime.strptime(request.args.get(name, ""), "%Y-%m-%d").date()
+    except ValueError:
+        return None
@@ -0,0 +1,84 @@
+import logging
+import os
+import time
+from collections import deque
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# the profiler is off unless SQL_PROFILE=1, as it adds a little work to
+# every query
+SQL_PROFILE = os.environ.get("SQL_PROFILE") == "1"
+# queries slower than this many milliseconds are written to the slow query log
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 100))
+# where to write the slow query log - if not set it goes to the app's log
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG")
+# how many of each request's slowest queries to keep
+SLOWEST_KEPT = 5
+
+slow_query_log = logging.getLogger("myserve.slow_queries")
+
+# the profiles of the most recent requests, shown on the staff debug page
+recent_profiles = deque(maxlen=50)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+
+    profile = g.get("sql_profile") if has_request_context() else None
+    if profile is not None:
+        profile["queries"] += 1
+        profile["time"] += elapsed
+        # keep the slowest few statements, slowest first
+        slowest = profile["slowest"]
+        if len(slowest) < SLOWEST_KEPT or elapsed > slowest[-1][0]:
+            slowest.append((elapsed, statement))
+            slowest.sort(key=lambda query: query[0], reverse=True)
+            del slowest[SLOWEST_KEPT:]
+
+    if elapsed >= SLOW_QUERY_MS:
+        endpoint = request.endpoint if has_request_context() else None
+        slow_query_log.warning(
+            "%.1f ms [%s] %s %r", elapsed, endpoint, statement, parameters)
+
+
+def start_profile():
+    g.sql_profile = {"queries": 0, "time": 0.0, "slowest": []}
+
+
+def finish_profile(response):
+    profile = g.pop("sql_profile", None)
+    if profile is None:
+        return response
+
+    response.headers["X-DB-Queries"] = str(profile["queries"])
+    response.headers["Server-Timing"] = (
+        f'db;dur={profile["time"]:.2f};desc="{profile["queries"]} queries"')
+
+    recent_profiles.appendleft({
+        "method": request.method,
+        "path": request.path,
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        **profile,
+    })
+    return response
+
+
+def init_profiler(app, engine):
+    """hooks the profiler into the app and database engine, if profiling is turned on"""
+    if not SQL_PROFILE:
+        return
+
+    if SLOW_QUERY_LOG:
+        handler = logging.FileHandler(SLOW_QUERY_LOG)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_query_log.addHandler(handler)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
@@ -0,0 +1,117 @@
+import os
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date
+from sqlalchemy import func
+from myserve import db
+from myserve.models import User, Log, Group, UserWeek, GroupWeek, FormWeek, TeacherWeek
+
+# the month and day each school term starts on, e.g. "02-01" is the 1st of
+# February. Holidays count towards the term before them, and January towards
+# the last term of the year before
+TERM_STARTS = [tuple(int(part) for part in start.split("-"))
+               for start in os.environ.get("TERM_STARTS", "02-01,04-26,07-19,10-11").split(",")]
+
+# how many rows are read from the log at a time when rebuilding the reports
+REBUILD_CHUNK_SIZE = int(os.environ.get("REBUILD_CHUNK_SIZE", 1000))
+
+# the rollups the analytics page can break hours down by
+BREAKDOWNS = {
+    "form": FormWeek,
+    "group": GroupWeek,
+    "teacher": TeacherWeek,
+}
+
+ROLLUPS = (UserWeek, GroupWeek, FormWeek, TeacherWeek)
+
+
+def term_of(week):
+    """returns the (year, term number) a week is in, going by the monday it starts on"""
+    term = bisect_right(TERM_STARTS, (week.month, week.day))
+    if term == 0:
+        return week.year - 1, len(TERM_STARTS)
+    return week.year, term
+
+
+def term_name(year, term):
+    return f"{year} Term {term}"
+
+
+def year_weeks(year):
+    """the first week of a school year, and the first week of the next one"""
+    month, day = TERM_STARTS[0]
+    return date(year, month, day), date(year + 1, month, day)
+
+
+def get_years():
+    """the school years that have hours logged in them, newest first"""
+    weeks = db.session.query(FormWeek.week).distinct()
+    return sorted({term_of(week)[0] for week, in weeks}, reverse=True)
+
+
+def weekly_totals(year):
+    """the hours logged across the school each week of a year, as a list of (week, hours)"""
+    start, end = year_weeks(year)
+    rows = db.session.query(
+        FormWeek.week, func.sum(FormWeek.hours)).filter(
+        FormWeek.week >= start, FormWeek.week < end).group_by(
+        FormWeek.week).order_by(FormWeek.week)
+    return [(week, float(hours or 0)) for week, hours in rows]
+
+
+def get_names(by):
+    """what to call each of the things hours can be broken down by"""
+    if by == "group":
+        return dict(Group.get_group_options())
+    if by == "teacher":
+        return {str(id): name for id, name in User.get_teacher_options()}
+    return {"": "No form class"}
+
+
+def term_breakdown(by, year):
+    """the hours logged in each term of a year by each form class, group or teacher, as a list of
+    (name, [hours in each term], total) with the most hours first"""
+    model = BREAKDOWNS[by]
+    key_column = getattr(model, model.KEY)
+    start, end = year_weeks(year)
+    rows = db.session.query(
+        key_column, model.week, model.hours).filter(
+        model.week >= start, model.week < end)
+
+    terms = defaultdict(lambda: [0.0] * len(TERM_STARTS))
+    for key, week, hours in rows:
+        terms[key][term_of(week)[1] - 1] += float(hours or 0)
+
+    names = get_names(by)
+    breakdown = [(names.get(key, key), hours, sum(hours)) for key, hours in terms.items()]
+    breakdown.sort(key=lambda row: row[2], reverse=True)
+    return breakdown
+
+
+def student_terms(user_id):
+    """the hours a student has logged in each term, as a list of (term name, hours) oldest first"""
+    terms = defaultdict(float)
+    for week, hours in db.session.query(UserWeek.week, UserWeek.hours).filter(
+            UserWeek.user_id == str(user_id)):
+        terms[term_of(week)] += float(hours or 0)
+    return [(term_name(*term), hours) for term, hours in sorted(terms.items())]
+
+
+def rebuild_reports():
+    """recalculates every report rollup from the log, in case they've drifted (e.g. after the log was
+    edited by hand). Returns how many log items were added up."""
+    for model in ROLLUPS:
+        model.query.delete(synchronize_session=False)
+
+    count = 0
+
+    def rows():
+        nonlocal count
+        for row in Log.report_rows().yield_per(REBUILD_CHUNK_SIZE):
+            count += 1
+            yield row
+
+    Log.adjust_reports(added=rows())
+    db.session.commit()
+    return count
+
@@ -1,31 +1,45 @@
 from typing import List
+import os
 from sqlalchemy.sql.sqltypes import String
-from myserve import db, app, data
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from myserve import db
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import current_user, login_required
-from myserve.forms import AddHours, JoinGroups, CreateGroup, UserUpload
-from myserve.models import USER_ROLE, User, Log, Group
+from myserve.forms import AddHours, JoinGroups, CreateGroup, UserUpload, RemoveUsers, JobAction
+from myserve.models import USER_ROLE, User, Log, Group, Award, Job
 from myserve.decorators import permission_required
-import os
+from myserve import profiler
+from myserve.leaderboard import leaderboards
+from myserve.pagination import date_arg
+from myserve.httpcache import conditional_page
+from myserve.jobs import job_queue, JOB_NAMES
+from myserve.imports import save_upload
+from myserve import exports, reports
 
 staff = Blueprint('staff', __name__)
 
+# how many students are shown on each page of the leaderboard
+LEADERBOARD_PAGE_SIZE = 25
+
+# where uploaded csv files wait to be imported, inside the instance folder
+UPLOAD_FOLDER = "uploads"
+
+
+def dashboard_state():
+    """the dashboard only shows the top students and how many students are in the user's groups, which
+    are quick to get without rendering the page"""
+    student_counts = Group.count_students(group.group_id for group in current_user.groups)
+    return leaderboards.top("school", count=5), sorted(student_counts.items())
+
 
 @staff.route('/dashboard')
 @login_required
 @permission_required(USER_ROLE["staff"])
+@conditional_page(dashboard_state)
 def dashboard():
-    # sort the groups a user is in by their size
-    groups = sorted(
-        current_user.groups_proxy,
-        key=lambda x: x.get_no_students(),
-        reverse=True)
+    # get the user's biggest groups
+    groups = Group.get_largest_groups(current_user, limit=5)
 
-    # shorten the list if it's too big
-    if len(groups) >= 5:
-        groups = groups[:5]
-
-    top_students = User.get_top_students()
+    top_students, _ = leaderboards.top("school", count=5)
 
     return render_template(
         "staff/dashboard.html",
@@ -38,11 +52,23 @@ def dashboard():
 @login_required
 @permission_required(USER_ROLE["staff"])
 def students():
-    students = User.get_students()
+    search = request.args.get("search", "")
+    form_class = request.args.get("form_class", "")
+    students = User.get_students(
+        search=search,
+        form_class=form_class,
+        cursor=request.args.get("cursor"),
+        page_size=request.args.get("page_size"))
+    # work out everyone's awards at once rather than a query per student
+    awards = Award.get_user_awards(students)
     return render_template(
         "staff/students.html",
         user=current_user,
-        students=students)
+        students=students,
+        awards=awards,
+        search=search,
+        form_class=form_class,
+        form_classes=User.get_form_classes())
 
 
 @staff.route('/students/log/<int:id>')
@@ -57,7 +83,13 @@ def student_log(id):
     return render_template(
         "staff/student_log.html",
         user=current_user,
-        student=student)
+        student=student,
+        terms=reports.student_terms(student.id),
+        log=student.get_log(
+            date_from=date_arg("date_from"),
+            date_to=date_arg("date_to"),
+            cursor=request.args.get("cursor"),
+            page_size=request.args.get("page_size")))
 
 
 @staff.route('/students/groups/<int:id>')
@@ -162,7 +194,15 @@ def groups():
         current_user.join_groups([new_group.id])
         flash(f"The group {new_group.name} was added successfuly.", "update")
 
-    return render_template("staff/groups.html", user=current_user, form=form)
+    # count the students in all of the user's groups at once
+    student_counts = Group.count_students(
+        group.group_id for group in current_user.groups)
+
+    return render_template(
+        "staff/groups.html",
+        user=current_user,
+        form=form,
+        student_counts=student_counts)
 
 
 @staff.route('/groups/edit', methods=['GET', 'POST'])
@@ -209,10 +249,16 @@ def group_detail(id):
         flash("Whoops! That page doesn't exist.", "error")
         return redirect(url_for('staff.dashboard'))
 
+    search = request.args.get("search", "")
     return render_template(
         "staff/group_detail.html",
         user=current_user,
-        group=group)
+        group=group,
+        students=group.get_students(
+            search=search,
+            cursor=request.args.get("cursor"),
+            page_size=request.args.get("page_size")),
+        search=search)
 
 
 @staff.route('/groups/delete/<int:id>')
@@ -224,18 +270,14 @@ def group_delete(id):
         flash("Whoops! That page doesn't exist.", "error")
         return redirect(url_for('staff.dashboard'))
 
-    # remove all the users in the group
-    for student in group.get_students():
-        group.remove_user(student.user)
-
-    for teacher in group.get_teachers():
-        group.remove_user(teacher)
-
-    # delete the group
-    group.delete()
-    flash(f"{group.name} was deleted successfully.", "update")
+    # the group is deleted in the background, along with its members and the
+    # hours logged under it. Its name is kept first, as the group may already
+    # be gone when the job runs straight away
+    name = group.name
+    job = job_queue.enqueue("delete_group", {"group_id": group.id}, user=current_user)
+    flash(f"{name} is being deleted.", "update")
 
-    return redirect(url_for("staff.groups"))
+    return redirect(url_for("staff.job_detail", id=job.id))
 
 
 @staff.route('/students/groups/delete/<int:student_id>/<int:group_id>')
@@ -261,8 +303,149 @@ def student_group_delete(student_id, group_id):
 @staff.route('/other-hours')
 @login_required
 @permission_required(USER_ROLE["staff"])
+@conditional_page(lambda: Log.get_state(Log.teacher_id == current_user.id))
 def other_hours():
-    return render_template("staff/other_hours.html", user=current_user)
+    search = request.args.get("search", "")
+    hours = current_user.get_hours_responsible(
+        search=search,
+        date_from=date_arg("date_from"),
+        date_to=date_arg("date_to"),
+        cursor=request.args.get("cursor"),
+        page_size=request.args.get("page_size"))
+    return render_template(
+        "staff/other_hours.html",
+        user=current_user,
+        hours=hours,
+        search=search)
+
+
+def check_export_format(format):
+    """returns a redirect back to the page the export was linked from if its format can't be made"""
+    if format not in exports.EXPORT_FORMATS:
+        flash("Excel exports aren't available on this server. Please download a .csv file instead.", "error")
+        return redirect(request.referrer or url_for('staff.dashboard'))
+
+
+@staff.route('/export/students.<any(csv, xlsx):format>')
+@login_required
+@permission_required(USER_ROLE["staff"])
+def export_students(format):
+    """every student's total hours and award, filtered like the students page"""
+    unavailable = check_export_format(format)
+    if unavailable:
+        return unavailable
+    return exports.export_response(
+        "student-totals",
+        exports.STUDENT_TOTALS_HEADER,
+        exports.student_totals(
+            search=request.args.get("search"),
+            form_class=request.args.get("form_class")),
+        format)
+
+
+@staff.route('/export/hours.<any(csv, xlsx):format>')
+@login_required
+@permission_required(USER_ROLE["staff"])
+def export_hours(format):
+    """all logged hours, optionally only a student's, a group's or a form class's, between two dates"""
+    unavailable = check_export_format(format)
+    if unavailable:
+        return unavailable
+    return exports.export_response(
+        "hours",
+        exports.HOURS_HISTORY_HEADER,
+        exports.hours_history(
+            student_id=request.args.get("student"),
+            group_id=request.args.get("group", type=int),
+            search=request.args.get("search"),
+            form_class=request.args.get("form_class"),
+            date_from=date_arg("date_from"),
+            date_to=date_arg("date_to")),
+        format)
+
+
+@staff.route('/export/groups/<int:id>.<any(csv, xlsx):format>')
+@login_required
+@permission_required(USER_ROLE["staff"])
+def export_group(id, format):
+    group = Group.load(id)
+    if not group:
+        flash("Whoops! That page doesn't exist.", "error")
+        return redirect(url_for('staff.dashboard'))
+
+    unavailable = check_export_format(format)
+    if unavailable:
+        return unavailable
+    return exports.export_response(
+        f"group-{group.id}",
+        exports.GROUP_HOURS_HEADER,
+        exports.group_hours(group, search=request.args.get("search")),
+        format)
+
+
+@staff.route('/analytics')
+@login_required
+@permission_required(USER_ROLE["staff"])
+def analytics():
+    # everything here is read from the weekly rollups rather than the log, so
+    # the page takes the same time however many hours have been logged
+    by = request.args.get("by", "form")
+    if by not in reports.BREAKDOWNS:
+        by = "form"
+    years = reports.get_years()
+    year = request.args.get("year", type=int)
+    if year not in years:
+        year = years[0] if years else None
+
+    return render_template(
+        "staff/analytics.html",
+        user=current_user,
+        by=by,
+        year=year,
+        years=years,
+        terms=[reports.term_name(year, term) for term in range(1, len(reports.TERM_STARTS) + 1)],
+        weekly=[(week.isoformat(), hours) for week, hours in reports.weekly_totals(year)] if year else [],
+        breakdown=reports.term_breakdown(by, year) if year else [])
+
+
+@staff.route('/leaderboard')
+@login_required
+@permission_required(USER_ROLE["staff"])
+def leaderboard():
+    # the scope is "school", "form:<form class>" or "group:<group id>"
+    scope_arg = request.args.get("scope", "school")
+    kind, _, key = scope_arg.partition(":")
+    if kind == "form" and key:
+        scope = ("form", key)
+    elif kind == "group" and key.isdigit() and Group.load(int(key)):
+        scope = ("group", int(key))
+    else:
+        scope_arg, scope = "school", "school"
+
+    page = request.args.get("page", 1, type=int)
+    page = max(page, 1)
+    entries, total = leaderboards.top(
+        scope, count=LEADERBOARD_PAGE_SIZE, offset=(page - 1) * LEADERBOARD_PAGE_SIZE)
+    pages = max((total + LEADERBOARD_PAGE_SIZE - 1) // LEADERBOARD_PAGE_SIZE, 1)
+
+    # find where a particular student sits in this leaderboard
+    student_id = request.args.get("student", "").strip()
+    student_rank = leaderboards.rank(student_id, scope) if student_id else None
+    if student_id and student_rank is None:
+        flash(f"Student {student_id} isn't on this leaderboard.", "error")
+
+    return render_template(
+        "staff/leaderboard.html",
+        user=current_user,
+        entries=entries,
+        total=total,
+        page=page,
+        pages=pages,
+        scope=scope_arg,
+        student_id=student_id,
+        student_rank=student_rank,
+        form_classes=leaderboards.form_classes(),
+        groups=Group.get_group_options())
 
 
 @staff.route('/manage/add', methods=['GET', 'POST'])
@@ -270,55 +453,13 @@ def other_hours():
 @permission_required(USER_ROLE["admin"])
 def manage_add():
     form = UserUpload()
-    errors = []
     if form.validate_on_submit():
-        # save the file the user wannts to upload
-        filename = data.save(form.file.data)
-        file_valid = True
-        file_path = app.config['UPLOADED_DATA_DEST'] + filename
-
-        with open(file_path) as file:
-            # split the row into a list while taking out the header row
-            file_rows = file.read().splitlines()[1:]
-            num_users = len(file_rows)
-
-            # process each row individulally
-            for index, row in enumerate(file_rows):
-                row_data = row.split(",")
-
-                # get the line no in a way that ordinary people will understand
-                line_no = index + 2
-
-                # check that they haven't left out info or added extra
-                if len(row_data) == 5:
-                    # validate the user from the csv
-                    new_user = User.enroll_new_user(
-                        row_data[0], row_data[1], row_data[2], row_data[3], row_data[4])
-
-                    # if new_user is a list, it means we've got a bunch of
-                    # errors and shouldn't upload the file
-                    if isinstance(new_user, list):
-                        file_valid = False
-                        errors.append((line_no, new_user))
-                else:
-                    file_valid = False
-                    errors.append(
-                        (line_no,
-                         [f"The user at line {line_no} was missing required information. Please ensure that you have at least entered the user's ID, email and role."]))
-
-            # if all of our users have been valid, then we can commit the
-            # changes to the db, otherwise we want to cancel the changes
-            if file_valid:
-                db.session.commit()
-                flash(f"{num_users} users were added successfully.", "update")
-            else:
-                flash(
-                    f"There were errors in the file you uploaded. None of the users have been uploaded.",
-                    "error")
-                db.session.rollback()
-
-        # delete the file the user uploaded to avoid clogging up storage
-        os.remove(file_path)
+        # the file is saved to the instance folder so the import can be retried,
+        # and the users are added from it in the background
+        path, rows = save_upload(form.file.data, os.path.join(current_app.instance_path, UPLOAD_FOLDER))
+        job = job_queue.enqueue("import_users", {"path": path}, total=rows, user=current_user)
+        flash("Your file was uploaded. The users are being added.", "update")
+        return redirect(url_for('staff.job_detail', id=job.id))
 
     # tell the user to actually upload a csv file
     elif form.is_submitted():
@@ -326,19 +467,48 @@ def manage_add():
     return render_template(
         "staff/manage_add.html",
         user=current_user,
-        form=form,
-        errors=errors)
+        form=form)
 
 
 @staff.route('/manage/remove')
 @login_required
 @permission_required(USER_ROLE["admin"])
 def manage_remove():
-    users = User.get_all()
+    search = request.args.get("search", "")
+    role = request.args.get("role", type=int)
+    users = User.get_all(
+        search=search,
+        role=role,
+        cursor=request.args.get("cursor"),
+        page_size=request.args.get("page_size"))
+    form = RemoveUsers()
     return render_template(
         "staff/manage_remove.html",
         user=current_user,
-        users=users)
+        users=users,
+        form=form,
+        search=search,
+        role=role)
+
+
+@staff.route('/manage/remove/selected', methods=['POST'])
+@login_required
+@permission_required(USER_ROLE["admin"])
+def manage_remove_selected():
+    form = RemoveUsers()
+    if form.validate_on_submit():
+        # admins can't remove their own account from here, as they'd be
+        # locked out halfway through
+        user_ids = [user_id for user_id in request.form.getlist("user_ids")
+                    if user_id != str(current_user.id)]
+        if user_ids:
+            job = job_queue.enqueue(
+                "remove_users", {"user_ids": user_ids}, total=len(user_ids), user=current_user)
+            flash(f"{len(user_ids)} user(s) are being removed.", "update")
+            return redirect(url_for('staff.job_detail', id=job.id))
+        else:
+            flash("Please select the users you want to remove.", "error")
+    return redirect(url_for('staff.manage_remove'))
 
 
 @staff.route('/manage/remove/<id>')
@@ -350,6 +520,71 @@ def manage_remove_user(id):
         flash("Whoops! That page doesn't exist.", "error")
         return redirect(url_for('staff.dashboard'))
 
-    user.remove()
-    flash(f"User {user.id} was removed successfully.", "update")
-    return redirect(url_for('staff.manage_remove'))
+    # the user may already be gone when the job runs straight away
+    user_id = user.id
+    job = job_queue.enqueue(
+        "remove_users", {"user_ids": [str(user_id)]}, total=1, user=current_user)
+    flash(f"User {user_id} is being removed.", "update")
+    return redirect(url_for('staff.job_detail', id=job.id))
+
+
+@staff.route('/jobs')
+@login_required
+@permission_required(USER_ROLE["staff"])
+def jobs():
+    # pick up any jobs that have got stuck since the queue started
+    job_queue.recover()
+    # admins can see everyone's jobs, staff just their own
+    owner = None if current_user.role_id == USER_ROLE["admin"] else current_user
+    return render_template(
+        "staff/jobs.html",
+        user=current_user,
+        jobs=Job.get_recent(owner),
+        job_names=JOB_NAMES,
+        get_progress=job_queue.get_progress)
+
+
+@staff.route('/jobs/<int:id>', methods=['GET', 'POST'])
+@login_required
+@permission_required(USER_ROLE["staff"])
+def job_detail(id):
+    job = Job.load(id)
+    if not job or not job.can_view(current_user):
+        flash("Whoops! That page doesn't exist.", "error")
+        return redirect(url_for('staff.dashboard'))
+
+    form = JobAction()
+    if form.validate_on_submit():
+        if form.cancel.data:
+            job_queue.cancel(job)
+            flash("The job is being cancelled.", "update")
+        elif form.retry.data:
+            if job_queue.retry(job):
+                flash("The job has been restarted.", "update")
+            else:
+                flash("Only failed or cancelled jobs can be retried.", "error")
+        return redirect(url_for('staff.job_detail', id=job.id))
+
+    return render_template(
+        "staff/job_detail.html",
+        user=current_user,
+        job=job,
+        result=job.get_result(),
+        progress=job_queue.get_progress(job),
+        job_name=JOB_NAMES.get(job.kind, job.kind),
+        form=form)
+
+
+@staff.route('/debug/queries')
+@login_required
+@permission_required(USER_ROLE["staff"])
+def debug_queries():
+    if not profiler.SQL_PROFILE:
+        flash("Query profiling is turned off. Set SQL_PROFILE=1 to turn it on.", "error")
+        return redirect(url_for('staff.dashboard'))
+
+    return render_template(
+        "staff/debug_queries.html",
+        user=current_user,
+        profiles=profiler.recent_profiles,
+        slow_query_ms=profiler.SLOW_QUERY_MS)
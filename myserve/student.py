@@ -1,15 +1,23 @@
 from myserve.decorators import permission_required
 from myserve.models import USER_ROLE, User, Log, Award, Group
 from myserve.forms import AddHours, JoinGroups
+from myserve.pagination import date_arg
+from myserve.httpcache import conditional_page
 from myserve import app
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import current_user, login_required
 student = Blueprint('student', __name__)
 
 
+def log_state(*args, **kwargs):
+    """the version of the current student's hours, see conditional_page"""
+    return Log.get_state(Log.user_id == current_user.id), Award.get_awards()
+
+
 @student.route('/dashboard')
 @login_required
 @permission_required(USER_ROLE["student"])
+@conditional_page(log_state)
 def dashboard():
 
     # get the user's current award and next one
@@ -86,8 +94,16 @@ def group_detail(id):
 @student.route('/log')
 @login_required
 @permission_required(USER_ROLE["student"])
+@conditional_page(log_state)
 def log():
-    return render_template("student/log.html", user=current_user)
+    return render_template(
+        "student/log.html",
+        user=current_user,
+        log=current_user.get_log(
+            date_from=date_arg("date_from"),
+            date_to=date_arg("date_to"),
+            cursor=request.args.get("cursor"),
+            page_size=request.args.get("page_size")))
 
 
 @student.route('/edit-hours/<int:id>', methods=['GET', 'POST'])
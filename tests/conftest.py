@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+# the app reads these when it's imported, so they're set before any test
+# imports it. Each test run gets its own empty database
+_folder = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_folder, "test.db")
+os.environ["JOB_WORKERS"] = "0"
+os.environ.pop("SQL_PROFILE", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from myserve import app as flask_app, db  # noqa: E402
+from myserve.cache import caches  # noqa: E402
+from myserve.leaderboard import leaderboards  # noqa: E402
+from myserve.models import Award, LogStatus, UserRole, User, USER_ROLE  # noqa: E402
+
+# the lookup tables in the bundled database
+ROLES = [(1, "student"), (2, "staff"), (3, "staff")]
+STATUSES = [(1, "Approved"), (2, "Modified"), (3, "Removed")]
+AWARDS = [(1, "Service for Graduation", "#7caa69", 2), (2, "Silver", "#aca9a9", 20),
+          (3, "Gold", "#f8c628", 30), (4, "Platinum", "#4d555f", 40)]
+
+# the tables tests add rows to, emptied after each test
+DATA_TABLES = ["log", "group_members", "group", "job", "user",
+               "report_user_week", "report_group_week", "report_form_week", "report_teacher_week"]
+
+
+@pytest.fixture(scope="session")
+def app():
+    flask_app.config["TESTING"] = True
+    flask_app.config["WTF_CSRF_ENABLED"] = False
+    with flask_app.app_context():
+        db.session.add_all([UserRole(id=id, name=name) for id, name in ROLES])
+        db.session.add_all([LogStatus(id=id, name=name) for id, name in STATUSES])
+        db.session.add_all([Award(id=id, name=name, colour=colour, threshold=threshold)
+                            for id, name, colour, threshold in AWARDS])
+        db.session.commit()
+    return flask_app
+
+
+@pytest.fixture
+def app_context(app):
+    """an app context for the test, with the data it added removed afterwards"""
+    with app.app_context():
+        yield
+        db.session.rollback()
+        for table in DATA_TABLES:
+            db.session.execute(db.text(f'DELETE FROM "{table}"'))
+        db.session.commit()
+    for cache in list(caches.values()):
+        if hasattr(cache, "clear"):
+            cache.clear()
+        else:
+            cache.invalidate()
+    leaderboards.invalidate()
+
+
+def add_user(user_id, role="student", first_name="Test", last_name="User", form_class=None, total=0):
+    user = User(id=user_id, first_name=first_name, last_name=last_name, email=f"{user_id}@test.school.nz",
+                form_class=form_class, role_id=USER_ROLE[role], total=total)
+    db.session.add(user)
+    return user
+
+
+def client_for(app, user_id):
+    """a test client logged in as a user, skipping the Google login"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+    return client
+
+
+@contextmanager
+def count_queries():
+    """counts the statements sent to the database inside the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
@@ -0,0 +1,39 @@
+import pytest
+import requests
+from myserve import auth
+
+
+class FailingClient:
+    """a provider client for when Google can't be reached"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        raise requests.ConnectionError("Google is down")
+
+    post = get
+
+
+@pytest.fixture
+def google_down(app, monkeypatch):
+    failing = FailingClient()
+    monkeypatch.setattr(auth.google_discovery, "client", failing)
+    monkeypatch.setattr(auth.google_discovery, "local_file", None)
+    monkeypatch.setattr(auth, "provider_client", failing)
+    auth.google_discovery.clear()
+    yield failing
+    auth.google_discovery.clear()
+
+
+@pytest.mark.parametrize("url", ["/login", "/login/callback?code=abc"])
+def test_login_redirects_when_discovery_fails_on_empty_cache(app, google_down, url):
+    client = app.test_client()
+    response = client.get(url)
+
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/")
+    assert google_down.calls == 1
+    with client.session_transaction() as session:
+        assert session["_flashes"] == [("error", "We couldn't reach Google to sign you in. Please try again.")]
@@ -0,0 +1,23 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_generated_school_has_report_rollups(tmp_path):
+    path = tmp_path / "school.db"
+    env = dict(os.environ)
+    env.pop("DATABASE_URL", None)
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "bench", "generate_school.py"), str(path),
+         "--students", "30", "--staff", "5", "--groups", "4", "--years", "1"],
+        check=True, env=env, cwd=ROOT, capture_output=True)
+
+    with sqlite3.connect(path) as connection:
+        for table in ("report_user_week", "report_group_week", "report_form_week", "report_teacher_week"):
+            assert connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] > 0, table
+        logged = connection.execute("SELECT SUM(time) FROM log").fetchone()[0]
+        rolled_up = connection.execute("SELECT SUM(hours) FROM report_user_week").fetchone()[0]
+    assert round(float(rolled_up), 2) == round(float(logged), 2)
@@ -0,0 +1,60 @@
+import datetime
+from decimal import Decimal
+from myserve import db
+from myserve.models import User, Group, GroupMembers, Log
+from conftest import add_user
+
+
+def make_group(name, *students):
+    group = Group(name=name)
+    db.session.add(group)
+    db.session.flush()
+    for student in students:
+        db.session.add(GroupMembers(user_id=student.id, group_id=group.id, group_hours=0))
+    db.session.commit()
+    return group
+
+
+def log_hours(student, group, hours):
+    Log.add_hours(student, str(group.id) if group else "None", "T001" if group is None else None,
+                  Decimal(hours), "Helping out", datetime.date.today())
+
+
+def test_group_delete_keeps_totals_consistent(app_context):
+    add_user("T001", role="staff")
+    first = add_user("20001")
+    second = add_user("20002")
+    db.session.commit()
+    hockey = make_group("Hockey", first, second)
+    choir = make_group("Choir", first)
+
+    log_hours(first, hockey, "2.5")
+    log_hours(first, hockey, "1")
+    log_hours(second, hockey, "4")
+    log_hours(first, choir, "3")
+    log_hours(first, None, "0.5")
+
+    counts = hockey.delete()
+    assert counts == {"students": 2, "hours": 3, "members": 2}
+    assert Log.reconcile_totals() == ([], [])
+    assert User.load_by_id("20001").total == Decimal("3.5")
+    assert User.load_by_id("20002").total == 0
+    assert Group.query.filter_by(name="Hockey").first() is None
+
+
+def test_remove_user_from_group_keeps_totals_consistent(app_context):
+    add_user("T001", role="staff")
+    first = add_user("20001")
+    second = add_user("20002")
+    db.session.commit()
+    hockey = make_group("Hockey", first, second)
+
+    log_hours(first, hockey, "2")
+    log_hours(second, hockey, "1.5")
+
+    hockey.remove_user(User.load_by_id("20001"))
+    assert Log.reconcile_totals() == ([], [])
+    assert User.load_by_id("20001").total == 0
+    assert User.load_by_id("20002").total == Decimal("1.5")
+    assert GroupMembers.load("20001", hockey.id) is None
+    assert Log.query.filter_by(user_id="20001").count() == 0
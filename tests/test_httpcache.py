@@ -0,0 +1,34 @@
+import datetime
+from decimal import Decimal
+from myserve import db
+from myserve.models import Log
+from conftest import add_user, client_for
+
+
+def log_hours(student, hours, log_time):
+    entry = Log.add_hours(student, "None", "T001", Decimal(hours), "Helping out", datetime.date.today())
+    entry.log_time = log_time
+    db.session.commit()
+    return entry
+
+
+def test_deleting_the_newest_hours_changes_the_page(app, app_context):
+    add_user("T001", role="staff")
+    student = add_user("20001")
+    db.session.commit()
+    log_hours(student, "1", datetime.datetime(2026, 3, 1, 9))
+    newest = log_hours(student, "2", datetime.datetime(2026, 3, 2, 9))
+
+    client = client_for(app, "20001")
+    response = client.get("/student/log")
+    etag = response.headers["ETag"]
+    assert "Last-Modified" not in response.headers
+    assert client.get("/student/log", headers={"If-None-Match": etag}).status_code == 304
+
+    db.session.delete(newest)
+    db.session.commit()
+
+    # the newest log_time went backwards, so a date check would wrongly say nothing changed
+    assert client.get("/student/log", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/student/log", headers={
+        "If-Modified-Since": "Mon, 02 Mar 2026 09:00:00 GMT"}).status_code == 200
@@ -0,0 +1,42 @@
+from myserve import db
+from myserve.models import User, USER_ROLE
+from conftest import add_user, count_queries
+
+
+def load_in_new_request(user_id):
+    """loads a user the way the login manager does at the start of a request"""
+    db.session.remove()
+    return User.load_cached(user_id)
+
+
+def test_cached_user_is_loaded_without_a_query(app_context):
+    add_user("20001", first_name="Aroha")
+    db.session.commit()
+
+    load_in_new_request("20001")
+    db.session.remove()
+    with count_queries() as statements:
+        user = User.load_cached("20001")
+    assert statements == []
+    assert user.first_name == "Aroha"
+
+
+def test_role_change_is_seen_on_next_load(app_context):
+    add_user("T001", role="staff")
+    db.session.commit()
+    assert load_in_new_request("T001").role_id == USER_ROLE["staff"]
+
+    User.query.get("T001").role_id = USER_ROLE["admin"]
+    db.session.commit()
+    assert load_in_new_request("T001").role_id == USER_ROLE["admin"]
+
+
+def test_name_change_is_seen_on_next_load(app_context):
+    add_user("20001", first_name="Aroha", last_name="Smith")
+    db.session.commit()
+    user = load_in_new_request("20001")
+    assert user.first_name == "Aroha"
+
+    user.update("Aroha", "Ngata", None)
+    user = load_in_new_request("20001")
+    assert (user.first_name, user.last_name) == ("Aroha", "Ngata")
@@ -0,0 +1,42 @@
+import io
+import os
+import pytest
+from myserve import db
+from myserve.models import User, Job
+from conftest import add_user, client_for
+
+HEADER = "User ID,First Name,Last Name,Form Class,Role\n"
+
+
+@pytest.fixture
+def uploads(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "instance_path", str(tmp_path))
+    return tmp_path / "uploads"
+
+
+def upload(app, rows):
+    add_user("A001", role="admin")
+    db.session.commit()
+    data = {"file": (io.BytesIO((HEADER + "".join(rows)).encode()), "users.csv"), "upload": "Upload"}
+    response = client_for(app, "A001").post("/staff/manage/add", data=data, content_type="multipart/form-data")
+    assert response.status_code == 302
+    return Job.query.order_by(Job.id.desc()).first()
+
+
+def test_upload_is_imported_from_disk(app, app_context, uploads):
+    job = upload(app, [f"2000{i},First,Last,13ABC,student\n" for i in range(3)])
+
+    assert job.status == "done"
+    assert job.total == 3
+    assert job.payload is None
+    assert User.get_existing_ids(["20000", "20001", "20002"]) == {"20000", "20001", "20002"}
+    # the file isn't needed once the users are in
+    assert os.listdir(uploads) == []
+
+
+def test_failed_upload_is_kept_for_retrying(app, app_context, uploads):
+    job = upload(app, ["20000,First,Last,13ABC\n"])
+
+    assert job.status == "failed"
+    assert os.path.exists(job.get_params()["path"])
+    assert os.listdir(uploads) == [os.path.basename(job.get_params()["path"])]
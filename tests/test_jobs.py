@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+from datetime import datetime
+from myserve import db
+from myserve.jobs import job_queue
+from myserve.models import Job
+
+
+def add_job(status, worker_pid=None, kind="remove_users"):
+    job = Job(kind=kind, status=status, params='{"user_ids": []}', worker_pid=worker_pid,
+              created=datetime.now(), progress=0, attempts=1, cancel_requested=False)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_jobs_left_behind_are_recovered_when_the_queue_starts(app, app_context):
+    orphaned = add_job("running", worker_pid=os.getpid())
+    crashed = add_job("running", worker_pid=dead_pid())
+    queued = add_job("queued")
+
+    # no request is needed for the queue to pick these up
+    job_queue.init_app(app)
+
+    db.session.expire_all()
+    assert Job.load(orphaned).status == "failed"
+    assert Job.load(crashed).status == "failed"
+    assert Job.load(queued).status == "done"
+
+
+def test_running_jobs_are_left_alone(app, app_context):
+    running_here = add_job("running", worker_pid=os.getpid())
+    job_queue.progress[running_here] = 0
+    running_elsewhere = add_job("running", worker_pid=os.getppid())
+    try:
+        job_queue.recover()
+    finally:
+        job_queue.progress.pop(running_here)
+
+    db.session.expire_all()
+    assert Job.load(running_here).status == "running"
+    assert Job.load(running_elsewhere).status == "running"
@@ -0,0 +1,23 @@
+import random
+import pytest
+from myserve.leaderboard import Ranking, RESORT_BATCH_SIZE
+
+
+@pytest.mark.parametrize("changed", [3, RESORT_BATCH_SIZE + 1])
+def test_batched_changes_match_a_fresh_ranking(changed):
+    rng = random.Random(changed)
+    hours = {str(i): float(rng.randint(0, 40)) for i in range(200)}
+    ranking = Ranking(hours)
+
+    differences = {str(i): float(rng.randint(-5, 5)) for i in rng.sample(range(200), changed)}
+    # students who aren't in the ranking are ignored
+    differences["not a student"] = 10.0
+    ranking.add_many(differences)
+
+    for user_id, difference in differences.items():
+        if user_id in hours:
+            hours[user_id] += difference
+    expected = Ranking(hours)
+    assert ranking.top(len(hours)) == expected.top(len(hours))
+    assert [ranking.rank(user_id) for user_id in hours] == [expected.rank(user_id) for user_id in hours]
+    assert "not a student" not in ranking
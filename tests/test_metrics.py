@@ -0,0 +1,23 @@
+import threading
+from myserve import metrics
+
+
+def requests_counted(endpoint):
+    stats = metrics.collect()["endpoints"].get(endpoint)
+    return sum(stats["status"].values()) if stats else 0
+
+
+def test_shards_from_finished_threads_are_retired(app):
+    before = requests_counted("metrics")
+
+    def scrape():
+        app.test_client().get("/metrics")
+
+    # like the development server, which handles each request on a new thread
+    for _ in range(200):
+        thread = threading.Thread(target=scrape)
+        thread.start()
+        thread.join()
+
+    assert requests_counted("metrics") == before + 200
+    assert len(metrics._shards) <= 1
@@ -0,0 +1,120 @@
+import time
+from types import SimpleNamespace
+import pytest
+import requests
+from myserve import oauth
+from myserve.oauth import DiscoveryCache
+
+URL = "https://accounts.example.com/.well-known/openid-configuration"
+
+
+class FakeResponse:
+    def __init__(self, document, cache_control):
+        self.document = document
+        self.headers = {"Cache-Control": cache_control}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.document
+
+
+class FakeProvider:
+    """hands out numbered versions of the discovery document, or fails while it's down"""
+
+    def __init__(self, cache_control="public, max-age=3600"):
+        self.cache_control = cache_control
+        self.calls = 0
+        self.down = False
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        if self.down:
+            raise requests.ConnectionError("provider is down")
+        return FakeResponse({"version": self.calls}, self.cache_control)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(oauth, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def wait_for_refresh(cache):
+    for _ in range(200):
+        if not cache._refreshing:
+            return
+        time.sleep(0.01)
+    raise AssertionError("the refresh never finished")
+
+
+def test_cached_copy_is_used_until_it_needs_refreshing(clock):
+    provider = FakeProvider()
+    cache = DiscoveryCache(URL, client=provider)
+
+    assert cache.get() == {"version": 1}
+    clock.now += 3000
+    assert cache.get() == {"version": 1}
+    assert provider.calls == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "refreshes": 0, "failures": 0}
+
+    # within REFRESH_MARGIN of expiring, a new copy is fetched in the background
+    clock.now += 400
+    assert cache.get() == {"version": 1}
+    wait_for_refresh(cache)
+    assert cache.get() == {"version": 2}
+
+
+def test_short_lived_copy_is_not_refreshed_on_every_hit(clock):
+    provider = FakeProvider("max-age=60")
+    cache = DiscoveryCache(URL, client=provider)
+
+    cache.get()
+    clock.now += 30
+    cache.get()
+    wait_for_refresh(cache)
+    assert provider.calls == 1
+
+    clock.now += 20
+    cache.get()
+    wait_for_refresh(cache)
+    assert provider.calls == 2
+
+
+def test_stale_copy_is_served_while_the_provider_is_down(clock):
+    provider = FakeProvider()
+    cache = DiscoveryCache(URL, client=provider, max_stale=24 * 3600)
+    cache.get()
+
+    provider.down = True
+    clock.now += 2 * 3600
+    assert cache.get() == {"version": 1}
+    wait_for_refresh(cache)
+    assert cache.failures == 1
+    assert cache.get() == {"version": 1}
+    wait_for_refresh(cache)
+
+
+def test_copy_older_than_max_stale_is_not_served(clock):
+    provider = FakeProvider()
+    cache = DiscoveryCache(URL, client=provider, max_stale=24 * 3600)
+    cache.get()
+
+    provider.down = True
+    clock.now += 24 * 3600 + 1
+    with pytest.raises(requests.ConnectionError):
+        cache.get()
+
+    # it's served again once the provider is back
+    provider.down = False
+    assert cache.get() == {"version": 3}
+
+
+def test_failure_with_nothing_cached_is_raised(clock):
+    provider = FakeProvider()
+    provider.down = True
+    cache = DiscoveryCache(URL, client=provider)
+    with pytest.raises(requests.ConnectionError):
+        cache.get()
@@ -0,0 +1,29 @@
+from myserve import db
+from myserve.models import User
+from conftest import add_user, client_for, count_queries
+
+
+def students_page_queries(app, students):
+    """adds students to the roster (on top of any already there) and counts the queries the staff
+    students page makes"""
+    start = User.query.count()
+    for i in range(start, start + students):
+        add_user(str(20000 + i), form_class="13ABC", total=i % 45)
+    db.session.commit()
+
+    client = client_for(app, "T001")
+    # the first request fills the caches, which only happens once
+    client.get("/staff/students")
+    with count_queries() as statements:
+        response = client.get("/staff/students")
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_students_page_queries_dont_grow_with_roster(app, app_context):
+    add_user("T001", role="staff", first_name="Staff", last_name="Member")
+    db.session.commit()
+
+    small = students_page_queries(app, 3)
+    large = students_page_queries(app, 40)
+    assert small == large